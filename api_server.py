@@ -2,15 +2,62 @@
 API СЕРВЕР ДЛЯ ДОСТУПНОСТИ РЕГИОНОВ С ИСТОРИЧЕСКИМИ ДАННЫМИ
 Запускается на Render.com
 """
+import os
+
+# Асинхронный режим (ASYNC_MODE=gevent): сетевые вызовы requests к GitHub и LDAP
+# становятся неблокирующими, один процесс держит сотни медленных запросов.
+# Патчить нужно до импорта requests/threading.
+ASYNC_MODE = os.environ.get('ASYNC_MODE', '').lower()
+if ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+import sys
 import time
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, make_response, g, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import json
 import requests
 from datetime import datetime, timedelta
-import os
 import base64
 import uuid
+import threading
+import hashlib
+import hmac
+import fnmatch
+import tempfile
+import shutil
+import mmap
+import gzip
+import bisect
+import math
+import itertools
+import re
+import logging
+from array import array
+from urllib.parse import quote
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from functools import wraps
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+try:
+    import fcntl
+except ImportError:  # Windows: выбор ведущего процесса прогрева недоступен
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:  # Без NumPy колонки истории хранятся в array.array
+    np = None
+
+try:
+    import brotli
+except ImportError:  # Без brotli готовые ответы сжимаем только gzip
+    brotli = None
 
 app = Flask(__name__)
 CORS(app)  # Разрешаем CORS для всех доменов
@@ -46,15 +93,613 @@ FALLBACK_USERS = {
 }
 
 # Конфигурация
-GITHUB_RAW_BASE = "https://raw.githubusercontent.com/whoyak/region-data-cache/main/"
+GITHUB_RAW_BASE = os.environ.get('GITHUB_RAW_BASE', "https://raw.githubusercontent.com/whoyak/region-data-cache/main/")
 CACHE_TIMEOUT = 60  # Кэшируем на 60 секунд
+# Дольше этого устаревшие данные не отдаем без ожидания обновления
+CACHE_MAX_STALENESS = float(os.environ.get('CACHE_MAX_STALENESS', 600))
+# Пауза между попытками обновления после ошибки GitHub
+CACHE_RETRY_INTERVAL = float(os.environ.get('CACHE_RETRY_INTERVAL', 5))
 
 # Кэш в памяти
 cache = {
     'data': {},
-    'timestamp': datetime.min
+    'timestamp': datetime.min,
+    'version': None,
+    'last_attempt': float('-inf'),
+    'last_error': None
+}
+# Обновляет cached_data.json только один поток, остальные читают текущую копию
+cache_refresh_lock = threading.Lock()
+
+# === UPSTREAM КЛИЕНТ (GitHub raw) ===
+# Общая сессия с keep-alive пулом: не платим TCP+TLS рукопожатие на каждый запрос
+UPSTREAM_TIMEOUT = int(os.environ.get('UPSTREAM_TIMEOUT', 10))
+# В асинхронном режиме запросов одновременно намного больше - и пул больше
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 200 if ASYNC_MODE == 'gevent' else 20))
+# Сколько файлов помнить для условных GET (только ETag/Last-Modified и версия:
+# распарсенный ответ хранит его владелец - file_cache или cache)
+UPSTREAM_VALIDATORS_MAX = int(os.environ.get('UPSTREAM_VALIDATORS_MAX', 512))
+
+upstream_session = requests.Session()
+upstream_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE)
+upstream_session.mount('https://', upstream_adapter)
+upstream_session.mount('http://', upstream_adapter)
+
+# Общий ограниченный пул потоков для параллельных загрузок файлов
+UPSTREAM_FETCH_WORKERS = int(os.environ.get('UPSTREAM_FETCH_WORKERS', 50 if ASYNC_MODE == 'gevent' else 8))
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_FETCH_WORKERS, thread_name_prefix='upstream')
+
+# Глобальный лимит одновременных запросов в GitHub: остальные ждут слот не
+# дольше UPSTREAM_QUEUE_TIMEOUT и получают ошибку (обработчики отдадут кэш)
+UPSTREAM_MAX_INFLIGHT = int(os.environ.get('UPSTREAM_MAX_INFLIGHT', UPSTREAM_POOL_SIZE))
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT', 2))
+upstream_slots = threading.BoundedSemaphore(UPSTREAM_MAX_INFLIGHT)
+
+# filename -> {'etag', 'last_modified', 'size', 'version'}
+upstream_validators = OrderedDict()
+upstream_lock = threading.Lock()
+
+# === ПОТОКОВЫЙ РАЗБОР cached_data.json ===
+# Общий файл читается из ответа кусками и разбирается по одному региону:
+# в памяти одновременно сырые байты одного региона, а не весь файл плюс
+# полный граф объектов. История региона остается закодированной (bytes) и
+# декодируется при построении ее индекса (get_aggregate_history_index).
+# Из снимка общего кэша файл не читается, а отображается в память (mmap):
+# история региона - memoryview на страницы файла, общие для всех воркеров.
+CACHED_DATA_STREAMING = os.environ.get('CACHED_DATA_STREAMING', '1').lower() in ('1', 'true', 'yes')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_JSON_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+# Все, кроме скобок и незакрытых строк: пропускается одним вызовом regex
+_JSON_SKIP = re.compile(rb'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+_JSON_SCALAR_END = re.compile(rb'[\s,}\]]')
+_JSON_WHITESPACE = re.compile(rb'\s*')
+_JSON_EMPTY_ARRAY = re.compile(rb'\s*\[\s*\]\s*')
+
+# Закодированный JSON: bytes из ответа GitHub или memoryview на снимок общего кэша
+ENCODED_JSON_TYPES = (bytes, bytearray, memoryview)
+
+def is_streamed_file(filename):
+    return CACHED_DATA_STREAMING and filename == 'cached_data.json'
+
+def scan_json_value(buffer, pos, state=None):
+    """Конец JSON-значения, начинающегося с buffer[pos]: (end, state)
+
+    end=None - значение еще не дочитано; state передается в следующий вызов
+    после дописывания буфера, и скан продолжается с места остановки.
+    """
+    first = buffer[pos:pos + 1]
+    if first == b'"':
+        match = _JSON_STRING.match(buffer, pos)
+        return (match.end(), None) if match else (None, None)
+    if first not in (b'{', b'['):
+        match = _JSON_SCALAR_END.search(buffer, pos)
+        return (match.start(), None) if match else (None, None)
+
+    scan_pos, depth = state or (pos, 0)
+    while True:
+        scan_pos = _JSON_SKIP.match(buffer, scan_pos).end()
+        if scan_pos >= len(buffer) or buffer[scan_pos] == 0x22:
+            # Конец буфера или строка без закрывающей кавычки
+            return None, (scan_pos, depth)
+        if buffer[scan_pos] in b'{[':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return scan_pos + 1, None
+        scan_pos += 1
+
+def iter_json_members(chunks):
+    """Пары (ключ, сырые байты значения) объекта верхнего уровня по мере чтения
+
+    chunks - куски bytes или весь JSON сразу как memoryview: тогда значения -
+    срезы memoryview без копирования.
+    """
+    if isinstance(chunks, memoryview):
+        buffer, chunks = chunks, iter(())
+    else:
+        buffer, chunks = bytearray(), iter(chunks)
+    mapped = isinstance(buffer, memoryview)
+    pos = 0
+    expect = 'open'
+    key = None
+    scan = None
+
+    while True:
+        pos = _JSON_WHITESPACE.match(buffer, pos).end()
+        char = buffer[pos] if pos < len(buffer) else None
+        complete = char is not None
+
+        if not complete:
+            pass
+        elif expect == 'open':
+            if char != 0x7b:  # {
+                raise ValueError('Ожидался JSON объект')
+            pos += 1
+            expect = 'key'
+        elif expect == 'key':
+            if char == 0x7d:  # } пустого объекта
+                return
+            match = _JSON_STRING.match(buffer, pos)
+            if match:
+                key = json.loads(match.group())
+                pos = match.end()
+                expect = 'colon'
+            elif char == 0x22:
+                complete = False
+            else:
+                raise ValueError(f'Ожидался ключ JSON на позиции {pos}')
+        elif expect == 'colon':
+            if char != 0x3a:  # :
+                raise ValueError(f'Ожидалось ":" на позиции {pos}')
+            pos += 1
+            expect = 'value'
+            scan = None
+        elif expect == 'value':
+            end, scan = scan_json_value(buffer, pos, scan)
+            if end is None:
+                complete = False
+            else:
+                yield key, buffer[pos:end] if mapped else bytes(buffer[pos:end])
+                pos = end
+                expect = 'next'
+        else:
+            if char == 0x7d:  # }
+                return
+            if char != 0x2c:  # ,
+                raise ValueError(f'Ожидалось "," на позиции {pos}')
+            pos += 1
+            expect = 'key'
+
+        if not complete:
+            # Разобранное начало буфера освобождаем и дочитываем следующий кусок
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('JSON оборван')
+            del buffer[:pos]
+            if scan is not None:
+                scan = (scan[0] - pos, scan[1])
+            pos = 0
+            buffer.extend(chunk)
+
+def decode_aggregate_region(raw):
+    """Значение верхнего уровня cached_data.json; history региона остается закодированной"""
+    if raw[:1] != b'{':
+        return json.loads(bytes(raw))
+    region = {}
+    for key, value in iter_json_members(raw if isinstance(raw, memoryview) else (raw,)):
+        region[key] = value if key == 'history' else json.loads(bytes(value))
+    return region
+
+def load_streamed_json(chunks, spool=None):
+    """cached_data.json из кусков: (данные, размер, sha1 тела)
+
+    spool - файл, куда тело пишется параллельно (снимок для общего кэша).
+    """
+    digest = hashlib.sha1()
+    size = 0
+
+    def counted():
+        nonlocal size
+        for chunk in chunks:
+            if chunk:
+                size += len(chunk)
+                digest.update(chunk)
+                if spool is not None:
+                    spool.write(chunk)
+                yield chunk
+
+    body = counted()
+    data = {}
+    for key, raw in iter_json_members(body):
+        data[key] = decode_aggregate_region(raw)
+        # Разбор идет долго - между регионами отдаем управление (gevent)
+        time.sleep(0)
+    # Дочитываем хвост после закрывающей скобки, чтобы размер и sha1 были полными
+    for _ in body:
+        pass
+    return data, size, digest.hexdigest()
+
+def load_mapped_json(handle):
+    """cached_data.json из снимка общего кэша с текущей позиции файла: (данные, размер)
+
+    Файл отображается в память только для чтения; закодированная история
+    регионов ссылается на его страницы и держит отображение, пока нужна.
+    Снимки заменяются через os.replace, поэтому отображенный файл не меняется.
+    """
+    offset = handle.tell()
+    view = memoryview(mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ))[offset:]
+    data = {}
+    for key, raw in iter_json_members(view):
+        data[key] = decode_aggregate_region(raw)
+        time.sleep(0)
+    return data, len(view)
+
+def dump_lazy_json(value):
+    """JSON в bytes; закодированная история (bytes) вставляется как есть"""
+    if isinstance(value, ENCODED_JSON_TYPES):
+        return bytes(value)
+    if isinstance(value, dict) and any(isinstance(item, ENCODED_JSON_TYPES + (dict,)) for item in value.values()):
+        members = [json.dumps(str(key), ensure_ascii=False).encode('utf-8') + b':' + dump_lazy_json(item)
+                   for key, item in value.items()]
+        return b'{' + b','.join(members) + b'}'
+    return json.dumps(value, ensure_ascii=False, default=json_default).encode('utf-8')
+
+def region_has_history(region):
+    """Есть ли у региона общего кэша записи истории (без декодирования)"""
+    history = region.get('history', [])
+    if isinstance(history, ENCODED_JSON_TYPES):
+        return _JSON_EMPTY_ARRAY.fullmatch(history) is None
+    return len(history) > 0
+
+# === КОМПАКТНЫЕ ЗАПИСИ ИСТОРИИ ===
+# Записи истории подряд несут одни и те же ключи и почти всегда тот же большой
+# текст base_layer/non_priority. При разборе файлов истории объекты JSON
+# становятся SnapshotRecord: общий на все записи кортеж ключей (раскладка) и
+# кортеж значений вместо отдельного dict, а длинные строки берутся из пула по
+# содержимому - одинаковый текст во всех записях и регионах хранится один раз.
+# Записи ведут себя как dict только для чтения и сериализуются в тот же JSON.
+# Пул ограничен суммарным размером строк: вытесненный текст остается у записей,
+# которые на него ссылаются, но пул его больше не удерживает
+TEXT_POOL_MAX_BYTES = int(os.environ.get('TEXT_POOL_MAX_BYTES', 16 * 1024 * 1024))
+# Короче этого строки не дедуплицируем: время и коды и так уникальны
+TEXT_POOL_MIN_LENGTH = 64
+SNAPSHOT_LAYOUTS_MAX = 1024
+
+# текст -> тот же текст (канонический объект)
+text_pool = OrderedDict()
+text_pool_lock = threading.Lock()
+text_pool_stats = {'hits': 0, 'misses': 0, 'bytes': 0, 'evictions': 0}
+# кортеж ключей -> (ключи, {ключ: позиция})
+snapshot_layouts = {}
+
+class SnapshotRecord(Mapping):
+    """Неизменяемая запись истории: раскладка ключей + кортеж значений"""
+    __slots__ = ('_layout', '_values')
+
+    def __init__(self, layout, values):
+        self._layout = layout
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._layout[1][key]]
+
+    def __contains__(self, key):
+        return key in self._layout[1]
+
+    def __iter__(self):
+        return iter(self._layout[0])
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, default=None):
+        position = self._layout[1].get(key)
+        return default if position is None else self._values[position]
+
+    def to_dict(self):
+        return dict(zip(self._layout[0], self._values))
+
+    def __repr__(self):
+        return f"SnapshotRecord({self.to_dict()!r})"
+
+def pooled_text(value):
+    """Канонический экземпляр длинной строки из пула"""
+    if len(value) < TEXT_POOL_MIN_LENGTH:
+        return value
+    size = sys.getsizeof(value)
+    if size > TEXT_POOL_MAX_BYTES:
+        return value
+    with text_pool_lock:
+        pooled = text_pool.get(value)
+        if pooled is not None:
+            text_pool_stats['hits'] += 1
+            text_pool.move_to_end(value)
+            return pooled
+        text_pool_stats['misses'] += 1
+        text_pool[value] = value
+        text_pool_stats['bytes'] += size
+        while text_pool_stats['bytes'] > TEXT_POOL_MAX_BYTES:
+            _, evicted = text_pool.popitem(last=False)
+            text_pool_stats['bytes'] -= sys.getsizeof(evicted)
+            text_pool_stats['evictions'] += 1
+    return value
+
+def compact_object(obj):
+    """object_hook для json.loads: dict -> SnapshotRecord"""
+    keys = tuple(obj)
+    layout = snapshot_layouts.get(keys)
+    if layout is None:
+        if len(snapshot_layouts) >= SNAPSHOT_LAYOUTS_MAX:
+            return obj
+        keys = tuple(sys.intern(key) for key in keys)
+        layout = snapshot_layouts.setdefault(keys, (keys, {key: i for i, key in enumerate(keys)}))
+    return SnapshotRecord(layout, tuple(
+        pooled_text(value) if type(value) is str else value for value in obj.values()
+    ))
+
+def decode_history_json(raw):
+    """JSON истории с компактными записями; объект верхнего уровня - обычный dict"""
+    if isinstance(raw, memoryview):
+        raw = bytes(raw)
+    data = json.loads(raw, object_hook=compact_object)
+    return data.to_dict() if isinstance(data, SnapshotRecord) else data
+
+def decode_upstream_json(filename, raw):
+    """Разбор файла GitHub: файлы истории - компактными записями"""
+    if filename.startswith('history_'):
+        return decode_history_json(raw)
+    return json.loads(raw)
+
+def json_default(value):
+    """Сериализация компактных записей (json.dumps default)"""
+    if isinstance(value, SnapshotRecord):
+        return value.to_dict()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def get_text_pool_stats():
+    with text_pool_lock:
+        return {
+            'entries': len(text_pool),
+            'bytes': text_pool_stats['bytes'],
+            'max_bytes': TEXT_POOL_MAX_BYTES,
+            'evictions': text_pool_stats['evictions'],
+            'layouts': len(snapshot_layouts),
+            'hits': text_pool_stats['hits'],
+            'misses': text_pool_stats['misses']
+        }
+
+
+class CompactJSONProvider(DefaultJSONProvider):
+    """JSON провайдер Flask, понимающий SnapshotRecord"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, SnapshotRecord):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+app.json = CompactJSONProvider(app)
+
+# === ОБЩИЙ КЭШ ДЛЯ ПРОЦЕССОВ GUNICORN ===
+# Каталог со снимками файлов GitHub: один процесс скачивает, остальные читают.
+# Пусто - у каждого процесса свой кэш, как раньше.
+# Снимок cached_data.json отображается в память (load_mapped_json): его
+# закодированная история - страницы файла, общие для всех воркеров. Свои у
+# каждого воркера остаются current регионов, кэш файлов (FILE_CACHE_MAX_BYTES)
+# и декодированные индексы истории (HISTORY_INDEX_MAX_ENTRIES).
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR', '')
+
+shared_cache_stats = {
+    'reads': 0,
+    'writes': 0,
+    'errors': 0
 }
 
+if SHARED_CACHE_DIR:
+    os.makedirs(SHARED_CACHE_DIR, exist_ok=True)
+
+# === КЭШ ФАЙЛОВ (region_*, history_*) ===
+# TTL по шаблону имени файла, берется первое совпадение: "шаблон=секунды,..."
+FILE_CACHE_TTL = os.environ.get(
+    'FILE_CACHE_TTL',
+    'history_*_*.json=3600,history_*.json=60,region_*.json=30,*=60'
+)
+FILE_CACHE_MAX_ENTRIES = int(os.environ.get('FILE_CACHE_MAX_ENTRIES', 256))
+FILE_CACHE_MAX_BYTES = int(os.environ.get('FILE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+def parse_ttl_rules(spec):
+    """Разбирает строку вида 'region_*.json=30,*=60' в список (шаблон, ttl)"""
+    rules = []
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        pattern, ttl = part.rsplit('=', 1)
+        try:
+            rules.append((pattern.strip(), float(ttl)))
+        except ValueError:
+            print(f"⚠️ Некорректное правило FILE_CACHE_TTL: {part}")
+    return rules
+
+FILE_CACHE_TTL_RULES = parse_ttl_rules(FILE_CACHE_TTL)
+
+# Отрицательный кэш: сколько помнить, что файла нет (404), и сколько таких файлов
+NEGATIVE_CACHE_TTL = float(os.environ.get('NEGATIVE_CACHE_TTL', 60))
+NEGATIVE_CACHE_MAX_ENTRIES = int(os.environ.get('NEGATIVE_CACHE_MAX_ENTRIES', 1024))
+
+# filename -> {'data', 'version', 'size', 'fetched_at', 'expires_at'}
+file_cache = OrderedDict()
+# filename -> момент (monotonic), до которого считаем файл отсутствующим
+missing_files = OrderedDict()
+file_cache_lock = threading.Lock()
+file_cache_stats = {
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0,
+    'bytes': 0,
+    'negative_hits': 0
+}
+
+# === МЕТРИКИ (формат Prometheus) ===
+# Счетчики и гистограммы в памяти процесса: запись - словарь под одним локом,
+# поэтому их можно держать включенными под полной нагрузкой. Метрики у каждого
+# воркера gunicorn свои (метка pid в /api/metrics).
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS_HELP = {
+    'dostupnost_http_requests_total': ('counter', 'HTTP запросы по маршруту, методу и статусу'),
+    'dostupnost_http_request_duration_seconds': ('histogram', 'Время обработки HTTP запроса'),
+    'dostupnost_upstream_fetches_total': ('counter', 'Запросы в GitHub по типу файла и результату'),
+    'dostupnost_upstream_fetch_duration_seconds': ('histogram', 'Время запроса в GitHub по типу файла'),
+    'dostupnost_ldap_requests_total': ('counter', 'Запросы к LDAP шлюзу по результату'),
+    'dostupnost_rate_limited_total': ('counter', 'Запросы, отклоненные лимитом частоты'),
+    'dostupnost_cache_events_total': ('counter', 'События кэшей: попадания, промахи, вытеснения'),
+    'dostupnost_cache_entries': ('gauge', 'Записей в кэше'),
+    'dostupnost_cache_bytes': ('gauge', 'Объем кэша в байтах'),
+    'dostupnost_cache_age_seconds': ('gauge', 'Возраст данных cached_data.json'),
+    'dostupnost_stream_subscribers': ('gauge', 'Открытые SSE соединения'),
+    'dostupnost_stream_changes_total': ('counter', 'Изменения current регионов, разосланные в SSE'),
+    'dostupnost_stream_coalesced_total': ('counter', 'SSE события, замененные более свежими до отправки')
+}
+
+metrics_lock = threading.Lock()
+# (имя, метки) -> значение; метки - кортеж пар (ключ, значение)
+metric_counters = {}
+# (имя, метки) -> [счетчики по корзинам..., сумма, количество]
+metric_histograms = {}
+
+def inc_counter(name, labels=(), value=1):
+    """Увеличивает счетчик"""
+    key = (name, labels)
+    with metrics_lock:
+        metric_counters[key] = metric_counters.get(key, 0) + value
+
+def observe(name, value, labels=()):
+    """Добавляет наблюдение в гистограмму"""
+    key = (name, labels)
+    position = bisect.bisect_left(METRICS_BUCKETS, value)
+    with metrics_lock:
+        histogram = metric_histograms.get(key)
+        if histogram is None:
+            histogram = metric_histograms[key] = [0] * (len(METRICS_BUCKETS) + 3)
+        histogram[position] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+def _format_labels(labels):
+    """Метки в синтаксисе Prometheus: {key="value",...}"""
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+def render_metrics(extra_samples):
+    """Текст метрик в формате Prometheus; extra_samples - [(имя, метки, значение)]"""
+    with metrics_lock:
+        counters = dict(metric_counters)
+        histograms = {key: list(value) for key, value in metric_histograms.items()}
+
+    # Метка pid различает воркеры gunicorn
+    pid = (('pid', os.getpid()),)
+    families = {}
+    for (name, labels), value in counters.items():
+        families.setdefault(name, []).append(f"{name}{_format_labels(pid + labels)} {value}")
+    for name, labels, value in extra_samples:
+        families.setdefault(name, []).append(f"{name}{_format_labels(pid + labels)} {value}")
+    for (name, labels), histogram in histograms.items():
+        labels = pid + labels
+        lines = families.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(METRICS_BUCKETS + ('+Inf',), histogram):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+
+    output = []
+    for name in sorted(families):
+        kind, help_text = METRICS_HELP.get(name, ('untyped', name))
+        output.append(f"# HELP {name} {help_text}")
+        output.append(f"# TYPE {name} {kind}")
+        output.extend(families[name])
+    return '\n'.join(output) + '\n'
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        inc_counter('dostupnost_http_requests_total', (
+            ('route', route), ('method', request.method), ('status', response.status_code)
+        ))
+        observe('dostupnost_http_request_duration_seconds', time.perf_counter() - started, (('route', route),))
+    return response
+
+# === ЗАЩИТА LDAP ШЛЮЗА ===
+# Keep-alive сессия к шлюзу и circuit breaker: после LDAP_BREAKER_THRESHOLD
+# сбоев подряд шлюз считается недоступным на LDAP_BREAKER_RESET_TIMEOUT секунд,
+# и вход сразу уходит в фолбэк. Затем один пробный запрос (half-open) решает,
+# закрыть breaker или открыть снова.
+LDAP_BREAKER_THRESHOLD = int(os.environ.get('LDAP_BREAKER_THRESHOLD', 3))
+LDAP_BREAKER_RESET_TIMEOUT = float(os.environ.get('LDAP_BREAKER_RESET_TIMEOUT', 30))
+
+ldap_session = requests.Session()
+ldap_session.verify = False  # Для самоподписанных сертификатов
+ldap_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=UPSTREAM_POOL_SIZE))
+ldap_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=UPSTREAM_POOL_SIZE))
+
+ldap_breaker = {
+    'state': 'closed',  # 'closed', 'open', 'half_open'
+    'failures': 0,
+    'opened_at': None,
+    'last_error': None,
+    'probe_in_flight': False,
+    'trips': 0
+}
+ldap_breaker_lock = threading.Lock()
+
+def ldap_breaker_allow():
+    """Можно ли сейчас обращаться к LDAP шлюзу"""
+    with ldap_breaker_lock:
+        if ldap_breaker['state'] == 'closed':
+            return True
+
+        if ldap_breaker['state'] == 'open':
+            if time.monotonic() - ldap_breaker['opened_at'] < LDAP_BREAKER_RESET_TIMEOUT:
+                return False
+            ldap_breaker['state'] = 'half_open'
+            ldap_breaker['probe_in_flight'] = False
+
+        # half_open: пропускаем только один пробный запрос
+        if ldap_breaker['probe_in_flight']:
+            return False
+        ldap_breaker['probe_in_flight'] = True
+        return True
+
+def ldap_breaker_record(success, error=None):
+    """Учитывает результат обращения к LDAP шлюзу"""
+    with ldap_breaker_lock:
+        ldap_breaker['probe_in_flight'] = False
+        if success:
+            if ldap_breaker['state'] != 'closed':
+                print("✅ LDAP шлюз снова доступен, circuit breaker закрыт")
+            ldap_breaker['state'] = 'closed'
+            ldap_breaker['failures'] = 0
+            return
+
+        ldap_breaker['failures'] += 1
+        ldap_breaker['last_error'] = error
+        if ldap_breaker['state'] == 'half_open' or (
+                ldap_breaker['state'] == 'closed' and ldap_breaker['failures'] >= LDAP_BREAKER_THRESHOLD):
+            ldap_breaker['state'] = 'open'
+            ldap_breaker['opened_at'] = time.monotonic()
+            ldap_breaker['trips'] += 1
+            print(f"🔌 LDAP circuit breaker открыт на {LDAP_BREAKER_RESET_TIMEOUT:g}с: {error}")
+
+def get_ldap_breaker_status():
+    """Состояние circuit breaker LDAP шлюза для /api/auth/health"""
+    with ldap_breaker_lock:
+        status = {
+            'state': ldap_breaker['state'],
+            'failures': ldap_breaker['failures'],
+            'trips': ldap_breaker['trips'],
+            'last_error': ldap_breaker['last_error'],
+            'threshold': LDAP_BREAKER_THRESHOLD,
+            'reset_timeout': LDAP_BREAKER_RESET_TIMEOUT
+        }
+        if ldap_breaker['state'] == 'open':
+            elapsed = time.monotonic() - ldap_breaker['opened_at']
+            status['retry_in'] = round(max(LDAP_BREAKER_RESET_TIMEOUT - elapsed, 0), 1)
+    return status
+
 def make_ldap_request(username, password):
     """Отправляет запрос на локальный LDAP сервер"""
     try:
@@ -64,6 +709,15 @@ def make_ldap_request(username, password):
                 'error': 'LDAP сервер не настроен',
                 'error_code': 'LDAP_NOT_CONFIGURED'
             }
+
+        if not ldap_breaker_allow():
+            inc_counter('dostupnost_ldap_requests_total', (('result', 'circuit_open'),))
+            return {
+                'success': False,
+                'error': 'LDAP сервер временно недоступен (circuit breaker открыт)',
+                'error_code': 'LDAP_CIRCUIT_OPEN',
+                'details': f"Последняя ошибка: {ldap_breaker['last_error']}"
+            }
         
         # Подготавливаем данные для LDAP
         ldap_data = {
@@ -74,7 +728,7 @@ def make_ldap_request(username, password):
         }
         
         # Отправляем запрос к локальному LDAP серверу
-        response = requests.post(
+        response = ldap_session.post(
             LDAP_SERVER_URL,
             json=ldap_data,
             timeout=LDAP_REQUEST_TIMEOUT,
@@ -82,13 +736,21 @@ def make_ldap_request(username, password):
         )
         
         if response.status_code == 200:
-            return {
+            result = {
                 'success': True,
                 'data': response.json(),
                 'auth_source': 'ldap_direct',
                 'response_time': response.elapsed.total_seconds()
             }
+            ldap_breaker_record(True)
+            inc_counter('dostupnost_ldap_requests_total', (('result', 'success'),))
+            return result
         else:
+            # 4xx - шлюз отвечает (например, неверный пароль), 5xx - шлюз неисправен
+            ldap_breaker_record(response.status_code < 500, f'HTTP {response.status_code}')
+            inc_counter('dostupnost_ldap_requests_total', (
+                ('result', 'rejected' if response.status_code < 500 else 'error'),
+            ))
             return {
                 'success': False,
                 'error': f'LDAP сервер вернул {response.status_code}',
@@ -97,6 +759,8 @@ def make_ldap_request(username, password):
             }
             
     except requests.exceptions.Timeout:
+        ldap_breaker_record(False, 'timeout')
+        inc_counter('dostupnost_ldap_requests_total', (('result', 'timeout'),))
         return {
             'success': False,
             'error': f'Таймаут подключения к LDAP серверу ({LDAP_REQUEST_TIMEOUT}с)',
@@ -104,6 +768,8 @@ def make_ldap_request(username, password):
             'details': 'LDAP сервер не ответил. Проверьте доступность и порты.'
         }
     except requests.exceptions.ConnectionError:
+        ldap_breaker_record(False, 'connection_error')
+        inc_counter('dostupnost_ldap_requests_total', (('result', 'connection_error'),))
         return {
             'success': False,
             'error': 'Не удалось подключиться к LDAP серверу',
@@ -111,62 +777,1671 @@ def make_ldap_request(username, password):
             'details': 'Проверьте URL и доступность LDAP сервера.'
         }
     except Exception as e:
+        ldap_breaker_record(False, str(e))
+        inc_counter('dostupnost_ldap_requests_total', (('result', 'error'),))
         return {
             'success': False,
             'error': f'Ошибка LDAP запроса: {str(e)}',
             'error_code': 'LDAP_REQUEST_ERROR'
         }
 
-def check_fallback_auth(username, password):
-    """Проверка учетных данных в фолбэк режиме"""
-    if username in FALLBACK_USERS:
-        if FALLBACK_USERS[username] == password:
-            return {
-                'success': True,
-                'username': username,
-                'display_name': username.split('@')[0] if '@' in username else username,
-                'email': username if '@' in username else f'{username}@t2.ru',
-                'department': 'Технический отдел',
-                'title': 'Пользователь системы',
-                'auth_source': 'fallback_mode'
-            }
-    
+# === ТОКЕНЫ СЕССИИ ===
+# После успешного входа выдаем подписанный HMAC токен со сроком действия.
+# Проверяется локально, без LDAP и без хранилища: шлюз нужен раз за сессию.
+# Секрет должен быть общим для всех процессов, иначе токен одного воркера
+# не примет другой: AUTH_TOKEN_SECRET или файл в SHARED_CACHE_DIR.
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 12 * 3600))
+# Требовать токен на эндпоинтах данных (по умолчанию выключено для старых клиентов)
+AUTH_TOKEN_REQUIRED = os.environ.get('AUTH_TOKEN_REQUIRED', '').lower() in ('1', 'true', 'yes')
+
+def load_shared_token_secret():
+    """Общий секрет в SHARED_CACHE_DIR: первый процесс создает, остальные читают"""
+    path = os.path.join(SHARED_CACHE_DIR, 'auth_token_secret')
+    try:
+        with open(path, 'r', encoding='ascii') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+
+    fd, tmp_path = tempfile.mkstemp(dir=SHARED_CACHE_DIR, prefix='.secret_')
+    try:
+        with os.fdopen(fd, 'w', encoding='ascii') as f:
+            f.write(base64.b64encode(os.urandom(32)).decode('ascii'))
+        try:
+            # link атомарен и не перезаписывает: при гонке побеждает один файл
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+    finally:
+        os.unlink(tmp_path)
+    with open(path, 'r', encoding='ascii') as f:
+        return f.read().strip()
+
+if not AUTH_TOKEN_SECRET and SHARED_CACHE_DIR:
+    try:
+        AUTH_TOKEN_SECRET = load_shared_token_secret()
+        print(f"🔑 Секрет токенов общий для процессов: {SHARED_CACHE_DIR}")
+    except OSError as e:
+        print(f"⚠️ Не удалось прочитать общий секрет токенов: {e}")
+if not AUTH_TOKEN_SECRET:
+    if AUTH_TOKEN_REQUIRED:
+        # Токен одного воркера другие отклонят с 401 - нужен общий секрет
+        print("❌ AUTH_TOKEN_REQUIRED включен без AUTH_TOKEN_SECRET и SHARED_CACHE_DIR: "
+              "при нескольких воркерах токены будут отклоняться")
+    else:
+        print("⚠️ AUTH_TOKEN_SECRET не задан: токены действуют только в этом процессе до перезапуска")
+    AUTH_TOKEN_SECRET = base64.b64encode(os.urandom(32)).decode('ascii')
+AUTH_TOKEN_KEY = AUTH_TOKEN_SECRET.encode('utf-8')
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def issue_session_token(username, auth_flow):
+    """Подписанный токен сессии для ответа на вход"""
+    now = int(time.time())
+    payload = {
+        'sub': username,
+        'src': auth_flow,
+        'iat': now,
+        'exp': now + AUTH_TOKEN_TTL,
+        'jti': uuid.uuid4().hex
+    }
+    body = _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    signature = _b64encode(hmac.new(AUTH_TOKEN_KEY, body.encode('ascii'), hashlib.sha256).digest())
+    return {
+        'token': f"{body}.{signature}",
+        'token_type': 'Bearer',
+        'token_expires_at': datetime.fromtimestamp(payload['exp']).isoformat()
+    }
+
+def verify_session_token(token):
+    """Проверка подписи и срока токена; возвращает данные токена или None"""
+    try:
+        body, signature = token.split('.')
+        expected = hmac.new(AUTH_TOKEN_KEY, body.encode('ascii'), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        payload = json.loads(_b64decode(body))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+    if not isinstance(payload, dict) or payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+# Токен из ?access_token= не должен попадать в журналы доступа
+_ACCESS_TOKEN_PARAM = re.compile(r'(access_token=)[^&\s"]*')
+ACCESS_LOG_ENVIRON_KEYS = ('QUERY_STRING', 'RAW_URI', 'REQUEST_URI')
+
+def redact_access_token(text):
+    return _ACCESS_TOKEN_PARAM.sub(r'\1***', text)
+
+class AccessTokenLogFilter(logging.Filter):
+    """Вырезает access_token из строк журнала доступа werkzeug"""
+
+    def filter(self, record):
+        if isinstance(record.args, tuple):
+            record.args = tuple(redact_access_token(arg) if isinstance(arg, str) else arg
+                                for arg in record.args)
+        return True
+
+class AccessTokenLog:
+    """Журнал доступа gevent (объект с write) без access_token"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data):
+        self.stream.write(redact_access_token(data))
+
+logging.getLogger('werkzeug').addFilter(AccessTokenLogFilter())
+
+@app.before_request
+def redact_access_token_environ():
+    """gunicorn пишет журнал доступа из environ после ответа - токена там быть не должно"""
+    if 'access_token=' in request.environ.get('QUERY_STRING', ''):
+        request.args  # разобрать параметры до замены
+        for key in ACCESS_LOG_ENVIRON_KEYS:
+            if key in request.environ:
+                request.environ[key] = redact_access_token(request.environ[key])
+
+def token_auth(view=None, allow_query_token=False):
+    """Декоратор: проверяет Bearer-токен локально (обязателен при AUTH_TOKEN_REQUIRED)
+
+    allow_query_token - принимать токен и из ?access_token= (EventSource в браузере
+    не умеет заголовки).
+    """
+    if view is None:
+        return lambda view: token_auth(view, allow_query_token)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.auth_user = None
+        header = request.headers.get('Authorization', '')
+        token = header[7:].strip() if header.lower().startswith('bearer ') else ''
+        if not token and allow_query_token:
+            token = request.args.get('access_token', '')
+
+        if token:
+            g.auth_user = verify_session_token(token)
+            if g.auth_user is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Недействительный или просроченный токен',
+                    'error_code': 'INVALID_TOKEN'
+                }), 401
+        elif AUTH_TOKEN_REQUIRED:
+            return jsonify({
+                'success': False,
+                'error': 'Требуется авторизация (Authorization: Bearer <token>)',
+                'error_code': 'TOKEN_REQUIRED'
+            }), 401
+
+        return view(*args, **kwargs)
+    return wrapper
+
+# === ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ ===
+# Token bucket на клиента (пользователь из токена, иначе IP) для каждого маршрута.
+# Бюджеты: "маршрут=запросов/секунд,...". Маршруты без бюджета не ограничены.
+RATE_LIMITS = os.environ.get('RATE_LIMITS', 'refresh=6/60,login=10/60,batch=60/60')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 10000))
+# Сколько доверенных прокси стоит перед сервером. По умолчанию 1 - прокси
+# Render.com: без него все клиенты имели бы адрес прокси и общий лимит.
+# Без прокси задайте 0, иначе клиент подставит свой адрес в X-Forwarded-For
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 1))
+if 'TRUSTED_PROXY_COUNT' not in os.environ:
+    print("⚠️ TRUSTED_PROXY_COUNT не задан: адрес клиента для лимитов берется из "
+          "X-Forwarded-For за одним прокси (Render.com). Без прокси задайте 0")
+
+if TRUSTED_PROXY_COUNT > 0:
+    # remote_addr = адрес, добавленный последним доверенным прокси (N-й справа)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+
+def parse_rate_limits(spec):
+    """Разбирает 'refresh=6/60,...' в {маршрут: (емкость, пополнение в секунду)}"""
+    limits = {}
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        name, budget = part.split('=', 1)
+        try:
+            count, period = budget.split('/')
+            limits[name.strip()] = (float(count), float(count) / float(period))
+        except ValueError:
+            print(f"⚠️ Некорректное правило RATE_LIMITS: {part}")
+    return limits
+
+RATE_LIMIT_RULES = parse_rate_limits(RATE_LIMITS)
+
+# (маршрут, клиент) -> [токены, время последнего пополнения]
+rate_buckets = OrderedDict()
+rate_limit_lock = threading.Lock()
+
+def get_client_key():
+    """Ключ клиента: пользователь из токена или IP (с учетом TRUSTED_PROXY_COUNT)"""
+    user = getattr(g, 'auth_user', None)
+    if user:
+        return f"user:{user.get('sub')}"
+    return f"ip:{request.remote_addr}"
+
+def take_rate_token(route, client):
+    """Списывает токен из корзины; возвращает 0 или сколько секунд ждать"""
+    capacity, refill = RATE_LIMIT_RULES[route]
+    now = time.monotonic()
+    key = (route, client)
+    with rate_limit_lock:
+        bucket = rate_buckets.get(key)
+        if bucket is None:
+            bucket = [capacity, now]
+            rate_buckets[key] = bucket
+            while len(rate_buckets) > RATE_LIMIT_MAX_KEYS:
+                rate_buckets.popitem(last=False)
+        else:
+            rate_buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * refill)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / refill
+
+def rate_limit(route):
+    """Декоратор: бюджет запросов маршрута на клиента, сверх него - 429 с Retry-After"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if route in RATE_LIMIT_RULES:
+                retry_after = take_rate_token(route, get_client_key())
+                if retry_after:
+                    inc_counter('dostupnost_rate_limited_total', (('route', route),))
+                    response = jsonify({
+                        'success': False,
+                        'error': 'Слишком много запросов, повторите позже',
+                        'error_code': 'RATE_LIMITED',
+                        'retry_after': math.ceil(retry_after)
+                    })
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(math.ceil(retry_after))
+                    return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def check_fallback_auth(username, password):
+    """Проверка учетных данных в фолбэк режиме"""
+    if username in FALLBACK_USERS:
+        if FALLBACK_USERS[username] == password:
+            return {
+                'success': True,
+                'username': username,
+                'display_name': username.split('@')[0] if '@' in username else username,
+                'email': username if '@' in username else f'{username}@t2.ru',
+                'department': 'Технический отдел',
+                'title': 'Пользователь системы',
+                'auth_source': 'fallback_mode'
+            }
+    
+    return {
+        'success': False,
+        'error': 'Неверные учетные данные',
+        'error_code': 'INVALID_CREDENTIALS'
+    }
+
+def upstream_file_type(filename):
+    """Тип файла GitHub для меток метрик"""
+    if filename == 'cached_data.json':
+        return 'cached_data'
+    if filename.startswith('region_'):
+        return 'region'
+    if filename.startswith('history_'):
+        return 'history_snapshot' if filename.count('_') >= 2 else 'history'
+    return 'other'
+
+def fetch_upstream(filename, current=None):
+    """Условный GET файла из GitHub (If-None-Match / If-Modified-Since)
+
+    current - запись вызывающего с уже распарсенным файлом ({'data', 'version'}):
+    запрос условный, только если ее версия совпадает с известными валидаторами.
+    Возвращает запись {'status', 'data', 'etag', 'last_modified', 'size', 'version'}, где
+    status: 'ok' (200), 'not_modified' (304, data - current['data']),
+    'missing' (404) или 'error'.
+    """
+    started = time.perf_counter()
+    result = _fetch_upstream(filename, current)
+    file_type = upstream_file_type(filename)
+    observe('dostupnost_upstream_fetch_duration_seconds', time.perf_counter() - started,
+            (('file_type', file_type),))
+    inc_counter('dostupnost_upstream_fetches_total', (('file_type', file_type), ('status', result['status'])))
+    return result
+
+def _fetch_upstream(filename, current):
+    """Сам запрос в GitHub для fetch_upstream"""
+    with upstream_lock:
+        known = upstream_validators.get(filename)
+    if not current or current.get('data') is None or not known or known['version'] != current['version']:
+        # Тела этой версии у вызывающего нет - на 304 нечего было бы отдать
+        known = None
+
+    headers = {}
+    if known:
+        if known['etag']:
+            headers['If-None-Match'] = known['etag']
+        if known['last_modified']:
+            headers['If-Modified-Since'] = known['last_modified']
+
+    if not upstream_slots.acquire(timeout=UPSTREAM_QUEUE_TIMEOUT):
+        print(f"⚠️ Очередь к GitHub переполнена, {filename} не загружен")
+        return {'status': 'error', 'data': None, 'error': 'upstream_busy'}
+
+    response = None
+    streamed = None
+    try:
+        url = f"{GITHUB_RAW_BASE}{filename}"
+        try:
+            response = upstream_session.get(url, headers=headers, timeout=UPSTREAM_TIMEOUT,
+                                            stream=is_streamed_file(filename))
+            if is_streamed_file(filename) and response.status_code == 200:
+                # Тело разбирается по мере чтения; слот занят, пока оно читается
+                spool = tempfile.TemporaryFile(dir=SHARED_CACHE_DIR) if SHARED_CACHE_DIR else None
+                data, size, digest = load_streamed_json(
+                    response.iter_content(STREAM_CHUNK_SIZE), spool
+                )
+                streamed = {'data': data, 'size': size, 'digest': digest, 'body_file': spool}
+        finally:
+            upstream_slots.release()
+            if response is not None and is_streamed_file(filename):
+                response.close()
+
+        if response.status_code == 304 and known:
+            with upstream_lock:
+                if filename in upstream_validators:
+                    upstream_validators.move_to_end(filename)
+            return dict(known, data=current['data'], status='not_modified')
+
+        if response.status_code == 200:
+            if streamed:
+                data, size, digest = streamed['data'], streamed['size'], streamed['digest']
+            else:
+                data, size = decode_upstream_json(filename, response.content), len(response.content)
+                digest = hashlib.sha1(response.content).hexdigest()
+            entry = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'size': size,
+                'version': response.headers.get('ETag') or digest
+            }
+            with upstream_lock:
+                if entry['etag'] or entry['last_modified']:
+                    upstream_validators[filename] = entry
+                    upstream_validators.move_to_end(filename)
+                    while len(upstream_validators) > UPSTREAM_VALIDATORS_MAX:
+                        upstream_validators.popitem(last=False)
+                else:
+                    upstream_validators.pop(filename, None)
+            if streamed:
+                return dict(entry, data=data, status='ok', body_file=streamed['body_file'])
+            return dict(entry, data=data, status='ok', body=response.content)
+
+        print(f"⚠️ Файл {filename} не найден: {response.status_code}")
+        if response.status_code == 404:
+            with upstream_lock:
+                upstream_validators.pop(filename, None)
+            return {'status': 'missing', 'data': None, 'http_status': 404}
+        return {'status': 'error', 'data': None, 'http_status': response.status_code}
+    except Exception as e:
+        print(f"❌ Ошибка загрузки {filename}: {e}")
+        return {'status': 'error', 'data': None, 'error': str(e)}
+
+def _shared_path(filename):
+    """Путь к снимку файла в общем кэше"""
+    return os.path.join(SHARED_CACHE_DIR, quote(filename, safe=''))
+
+def _read_shared_meta(handle):
+    """Первая строка снимка - метаданные (version, etag, last_modified)"""
+    return json.loads(handle.readline())
+
+def shared_cache_read(filename, max_age, current=None):
+    """Файл из общего кэша процессов, если снимок не старше max_age секунд
+
+    Свежесть снимка - его mtime: ведущий процесс обновляет его при каждом
+    ответе GitHub (включая 304). Если версия совпадает с current (уже
+    распарсенной в этом процессе), повторно JSON не разбираем.
+    """
+    if not SHARED_CACHE_DIR or max_age <= 0:
+        return None
+
+    path = _shared_path(filename)
+    try:
+        age = time.time() - os.stat(path).st_mtime
+        if age >= max_age:
+            return None
+
+        with open(path, 'rb') as handle:
+            meta = _read_shared_meta(handle)
+            if current and current.get('data') is not None and current['version'] == meta['version']:
+                data, size = current['data'], current.get('size', 0)
+            elif is_streamed_file(filename):
+                data, size = load_mapped_json(handle)
+            else:
+                body = handle.read()
+                data, size = decode_upstream_json(filename, body), len(body)
+            entry = {
+                'etag': meta.get('etag'),
+                'last_modified': meta.get('last_modified'),
+                'size': size,
+                'version': meta['version']
+            }
+            # Запоминаем валидаторы, чтобы следующий запрос в GitHub был условным
+            with upstream_lock:
+                upstream_validators[filename] = entry
+                upstream_validators.move_to_end(filename)
+                while len(upstream_validators) > UPSTREAM_VALIDATORS_MAX:
+                    upstream_validators.popitem(last=False)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        shared_cache_stats['errors'] += 1
+        print(f"⚠️ Общий кэш: не удалось прочитать {filename}: {e}")
+        return None
+
+    shared_cache_stats['reads'] += 1
+    return dict(entry, data=data, status='shared', age=max(age, 0))
+
+def shared_cache_write(filename, result):
+    """Сохраняет ответ GitHub в общий кэш (атомарная замена файла)"""
+    if not SHARED_CACHE_DIR:
+        return
+
+    path = _shared_path(filename)
+    try:
+        body = result.get('body')
+        if result['status'] == 'not_modified':
+            # Тело не менялось - только продлеваем свежесть снимка
+            try:
+                with open(path, 'rb') as handle:
+                    meta = _read_shared_meta(handle)
+                if meta['version'] == result['version']:
+                    os.utime(path, None)
+                    return
+            except FileNotFoundError:
+                pass
+            # Снимка нет или он чужой версии - пишем заново из распарсенных данных
+            body = dump_lazy_json(result['data'])
+
+        body_file = result.get('body_file')
+        if body is None and body_file is None:
+            return
+
+        meta = {
+            'filename': filename,
+            'version': result['version'],
+            'etag': result['etag'],
+            'last_modified': result['last_modified']
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=SHARED_CACHE_DIR, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(json.dumps(meta).encode('utf-8') + b'\n')
+                if body is not None:
+                    handle.write(body)
+                else:
+                    # Тело потокового ответа уже лежит во временном файле
+                    body_file.seek(0)
+                    shutil.copyfileobj(body_file, handle, STREAM_CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        shared_cache_stats['writes'] += 1
+    except (OSError, ValueError, KeyError) as e:
+        shared_cache_stats['errors'] += 1
+        print(f"⚠️ Общий кэш: не удалось записать {filename}: {e}")
+
+def fetch_file(filename, max_age=0, current=None):
+    """Файл из общего кэша процессов (если он свежий) или из GitHub
+
+    current - распарсенная запись вызывающего, ее data переиспользуется,
+    если версия не изменилась.
+    """
+    shared = shared_cache_read(filename, max_age, current)
+    if shared:
+        return shared
+
+    result = fetch_upstream(filename, current)
+    if result['status'] in ('ok', 'not_modified'):
+        shared_cache_write(filename, result)
+    if result['status'] == 'ok' and is_streamed_file(filename):
+        # Свою копию истории меняем на отображение только что записанного снимка
+        mapped = shared_cache_read(filename, float('inf'))
+        if mapped and mapped['version'] == result['version']:
+            result['data'] = mapped['data']
+    result.pop('body', None)
+    body_file = result.pop('body_file', None)
+    if body_file is not None:
+        body_file.close()
+    return result
+
+def get_file_ttl(filename):
+    """TTL файла по правилам FILE_CACHE_TTL"""
+    for pattern, ttl in FILE_CACHE_TTL_RULES:
+        if fnmatch.fnmatchcase(filename, pattern):
+            return ttl
+    return CACHE_TIMEOUT
+
+def _evict_file_cache():
+    """Вытесняет самые давние записи сверх лимитов (вызывать под file_cache_lock)"""
+    while file_cache and (len(file_cache) > FILE_CACHE_MAX_ENTRIES
+                          or file_cache_stats['bytes'] > FILE_CACHE_MAX_BYTES):
+        _, evicted = file_cache.popitem(last=False)
+        file_cache_stats['bytes'] -= evicted['size']
+        file_cache_stats['evictions'] += 1
+
+def _remember_missing(filename, now):
+    """Запоминает отсутствие файла (вызывать под file_cache_lock)"""
+    if NEGATIVE_CACHE_TTL <= 0:
+        return
+    missing_files[filename] = now + NEGATIVE_CACHE_TTL
+    missing_files.move_to_end(filename)
+    while len(missing_files) > NEGATIVE_CACHE_MAX_ENTRIES:
+        missing_files.popitem(last=False)
+
+def get_cached_file_entry(filename, force=False, shared_max_age=None):
+    """Запись файла из кэша (с TTL и LRU); force - перепроверить в GitHub
+
+    shared_max_age - какой возраст снимка из общего кэша процессов принимать
+    (по умолчанию TTL файла, а при force - только свежий ответ GitHub).
+    """
+    now = time.monotonic()
+    with file_cache_lock:
+        entry = file_cache.get(filename)
+        if entry and not force and entry['expires_at'] > now:
+            file_cache.move_to_end(filename)
+            file_cache_stats['hits'] += 1
+            return entry
+
+        missing_until = missing_files.get(filename)
+        if missing_until is not None:
+            if not force and missing_until > now:
+                file_cache_stats['negative_hits'] += 1
+                return None
+            del missing_files[filename]
+
+        file_cache_stats['misses'] += 1
+
+    ttl = get_file_ttl(filename)
+    if shared_max_age is None:
+        shared_max_age = 0 if force else ttl
+    result = fetch_file(filename, shared_max_age, entry)
+
+    if result['data'] is None:
+        if result['status'] == 'error' and entry:
+            # GitHub недоступен - отдаем последнюю удачную версию и, как для
+            # cached_data.json, повторяем запрос не раньше CACHE_RETRY_INTERVAL
+            with file_cache_lock:
+                if file_cache.get(filename) is entry:
+                    entry['expires_at'] = max(entry['expires_at'], now + CACHE_RETRY_INTERVAL)
+            return entry
+        if result['status'] == 'missing':
+            with file_cache_lock:
+                dropped = file_cache.pop(filename, None)
+                if dropped:
+                    file_cache_stats['bytes'] -= dropped['size']
+                _remember_missing(filename, now)
+        return None
+
+    new_entry = {
+        'data': result['data'],
+        'version': result['version'],
+        'size': result['size'],
+        'fetched_at': now,
+        'expires_at': now + ttl - result.get('age', 0)
+    }
+    with file_cache_lock:
+        old = file_cache.pop(filename, None)
+        if old:
+            file_cache_stats['bytes'] -= old['size']
+        file_cache[filename] = new_entry
+        file_cache_stats['bytes'] += new_entry['size']
+        _evict_file_cache()
+
+    return new_entry
+
+def get_cached_file(filename, force=False):
+    """Данные файла из GitHub через кэш файлов"""
+    entry = get_cached_file_entry(filename, force=force)
+    return entry['data'] if entry else None
+
+def is_file_cached(filename):
+    """Есть ли для файла свежий ответ в памяти (данные или известное отсутствие)"""
+    now = time.monotonic()
+    with file_cache_lock:
+        entry = file_cache.get(filename)
+        if entry and entry['expires_at'] > now:
+            return True
+        missing_until = missing_files.get(filename)
+        return missing_until is not None and missing_until > now
+
+def get_file_cache_stats():
+    """Статистика кэша файлов для мониторинга"""
+    with file_cache_lock:
+        stats = dict(file_cache_stats)
+        stats['entries'] = len(file_cache)
+        stats['negative_entries'] = len(missing_files)
+    stats['max_entries'] = FILE_CACHE_MAX_ENTRIES
+    stats['max_bytes'] = FILE_CACHE_MAX_BYTES
+    return stats
+
+def _refresh_cached_data(max_age=CACHE_TIMEOUT):
+    """Загружает cached_data.json в кэш (вызывать под cache_refresh_lock)"""
+    cache['last_attempt'] = time.monotonic()
+    result = fetch_file("cached_data.json", max_age, cache)
+
+    if result['data']:
+        previous = cache['data']
+        cache['data'] = result['data']
+        cache['version'] = result['version']
+        cache['timestamp'] = datetime.now() - timedelta(seconds=result.get('age', 0))
+        cache['last_error'] = None
+        publish_region_changes(previous, result['data'])
+        return True
+
+    cache['last_error'] = result.get('error') or result['status']
+    return False
+
+def _refresh_allowed():
+    """После ошибки GitHub не повторяем попытку чаще CACHE_RETRY_INTERVAL"""
+    if cache['last_error'] is None:
+        return True
+    return time.monotonic() - cache['last_attempt'] >= CACHE_RETRY_INTERVAL
+
+def get_cached_data():
+    """Получает данные с кэшированием (stale-while-revalidate)"""
+    age = (datetime.now() - cache['timestamp']).total_seconds()
+    if age < CACHE_TIMEOUT and cache['data']:
+        return cache['data']
+
+    if cache['data'] and age < CACHE_MAX_STALENESS:
+        # Обновляет только один запрос, остальные сразу получают текущую копию
+        if cache_refresh_lock.acquire(blocking=False):
+            try:
+                if _refresh_allowed():
+                    _refresh_cached_data()
+            finally:
+                cache_refresh_lock.release()
+        return cache['data']
+
+    # Данных нет или они слишком старые - ждем обновления
+    with cache_refresh_lock:
+        age = (datetime.now() - cache['timestamp']).total_seconds()
+        if (age >= CACHE_TIMEOUT or not cache['data']) and _refresh_allowed():
+            _refresh_cached_data()
+
+    # При ошибке GitHub отдаем последние удачные данные
+    return cache['data'] or None
+
+def get_cached_data_version(data):
+    """Версия cached_data.json, если data - текущий объект кэша (иначе None)"""
+    if data is not None and cache['data'] is data:
+        return cache['version']
+    return None
+
+def get_cached_data_status():
+    """Состояние кэша cached_data.json для мониторинга"""
+    has_data = bool(cache['data'])
+    return {
+        'loaded': has_data,
+        'age_seconds': round((datetime.now() - cache['timestamp']).total_seconds(), 1) if has_data else None,
+        'version': cache['version'],
+        'last_error': cache['last_error']
+    }
+
+# === ИНДЕКС ИСТОРИИ ===
+# Для каждого списка истории один раз (при обновлении кэша) разбираем
+# full_timestamp и строим колонки, отсортированные по времени: int64 epoch,
+# позиции записей в исходном списке и числовые поля stats. Фильтр по hours,
+# страницы и поиск ближайшей записи - двоичный поиск по колонке epoch,
+# агрегаты - векторные операции. Отдельных списков записей и времен не храним.
+HISTORY_INDEX_MAX_ENTRIES = int(os.environ.get('HISTORY_INDEX_MAX_ENTRIES', 256))
+
+# Числовые поля stats, которые храним колонками (вместе с epoch-временем записи)
+SERIES_FIELDS = (
+    'total_bs',
+    'base_layer_count',
+    'base_layer_percentage',
+    'power_problems',
+    'non_priority_percentage'
+)
+
+# (источник, код региона) -> индекс; индекс действителен, пока тот же список истории
+history_indexes = OrderedDict()
+history_index_lock = threading.Lock()
+
+def parse_history_time(value):
+    """ISO-время записи истории в epoch секунды (None, если не разобрать)"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _stat_value(stats, field):
+    """Числовое значение из stats или NaN"""
+    value = stats.get(field)
+    if isinstance(value, bool):
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def build_series(epochs, positions, items):
+    """Колонки истории: int64 epoch, int32 позиция записи и float64 для SERIES_FIELDS
+
+    С NumPy это numpy-массивы (векторные фильтры и агрегаты), без него - array.array.
+    NaN означает, что поля в записи нет.
+    """
+    columns = {field: [] for field in SERIES_FIELDS}
+    for item in items:
+        stats = item.get('stats') or {}
+        for field in SERIES_FIELDS:
+            columns[field].append(_stat_value(stats, field))
+
+    if np is not None:
+        series = {
+            'epoch': np.array([math.floor(epoch) for epoch in epochs], dtype=np.int64),
+            'position': np.array(positions, dtype=np.int32)
+        }
+        for field in SERIES_FIELDS:
+            series[field] = np.array(columns[field], dtype=np.float64)
+    else:
+        series = {
+            'epoch': array('q', (math.floor(epoch) for epoch in epochs)),
+            'position': array('i', positions)
+        }
+        for field in SERIES_FIELDS:
+            series[field] = array('d', columns[field])
+    return series
+
+def search_epoch(epochs, value, side='right'):
+    """Двоичный поиск по колонке epoch (как bisect_right / bisect_left)"""
+    if np is not None:
+        return int(np.searchsorted(epochs, value, side))
+    if side == 'right':
+        return bisect.bisect_right(epochs, value)
+    return bisect.bisect_left(epochs, value)
+
+def index_items(index, lo, hi):
+    """Записи истории с позиций [lo, hi) колонок индекса (по времени)"""
+    history = index['history']
+    positions = index['series']['position'][lo:hi]
+    if np is not None:
+        positions = positions.tolist()
+    return [history[pos] for pos in positions]
+
+def series_range(index, start=None, end=None):
+    """Позиции [lo, hi) записей с start < epoch <= end в колонках индекса"""
+    epochs = index['series']['epoch']
+    lo = 0 if start is None else search_epoch(epochs, start)
+    hi = len(epochs) if end is None else search_epoch(epochs, end)
+    return lo, max(lo, hi)
+
+def series_aggregate(column, lo, hi):
+    """min/max/avg/last по срезу колонки без учета NaN (None, если значений нет)"""
+    if np is not None:
+        values = column[lo:hi]
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return None
+        return {
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'avg': float(values.mean()),
+            'last': float(values[-1])
+        }
+
+    values = [value for value in column[lo:hi] if not math.isnan(value)]
+    if not values:
+        return None
+    return {
+        'min': min(values),
+        'max': max(values),
+        'avg': sum(values) / len(values),
+        'last': values[-1]
+    }
+
+def build_history_index(history, source=None):
+    """Сортированный по времени индекс списка записей истории
+
+    source - объект, по identity которого индекс считается актуальным
+    (по умолчанию сам список); индекс владеет списком history.
+    """
+    parsed = []
+    unparsed = []
+    for pos, item in enumerate(history):
+        epoch = parse_history_time(item.get('full_timestamp', '2000-01-01'))
+        if epoch is None:
+            unparsed.append(item)
+        else:
+            parsed.append((epoch, pos))
+
+    # Исходный порядок (обычно хронологический) сохраняем при выдаче
+    descending = len(parsed) > 1 and all(
+        parsed[i][0] >= parsed[i + 1][0] for i in range(len(parsed) - 1)
+    ) and parsed[0][0] > parsed[-1][0]
+
+    # Записи с одинаковым временем при выдаче идут в исходном порядке
+    parsed.sort(key=(lambda pair: (pair[0], -pair[1])) if descending else None)
+    return {
+        'source': history if source is None else source,
+        'history': history,
+        'series': build_series(
+            [epoch for epoch, _ in parsed],
+            [pos for _, pos in parsed],
+            [history[pos] for _, pos in parsed]
+        ),
+        'unparsed': unparsed,
+        'descending': descending
+    }
+
+def get_history_index(key, history, decode=None):
+    """Индекс истории из кэша или построенный заново, если источник сменился
+
+    decode - если history закодирована (bytes): индекс проверяется по identity
+    байтов, а декодирование выполняется только при построении индекса.
+    """
+    with history_index_lock:
+        index = history_indexes.get(key)
+        if index and index['source'] is history:
+            history_indexes.move_to_end(key)
+            return index
+
+    if decode is None:
+        index = build_history_index(history)
+    else:
+        index = build_history_index(decode(history), history)
+    with history_index_lock:
+        history_indexes[key] = index
+        history_indexes.move_to_end(key)
+        while len(history_indexes) > HISTORY_INDEX_MAX_ENTRIES:
+            history_indexes.popitem(last=False)
+    return index
+
+def history_since(index, cutoff):
+    """Записи новее cutoff (epoch) в исходном порядке; неразобранные - всегда"""
+    epochs = index['series']['epoch']
+    items = index_items(index, search_epoch(epochs, cutoff), len(epochs))
+    if index['descending']:
+        items.reverse()
+    return items + index['unparsed']
+
+def history_closest(index, target):
+    """Запись с ближайшим к target (epoch) временем"""
+    epochs = index['series']['epoch']
+    if not len(epochs):
+        return None
+
+    pos = search_epoch(epochs, target, 'left')
+    if pos == len(epochs) or (pos > 0 and target - epochs[pos - 1] <= epochs[pos] - target):
+        pos -= 1
+    return index_items(index, pos, pos + 1)[0]
+
+# === ПОСТРАНИЧНАЯ ВЫДАЧА ИСТОРИИ ===
+HISTORY_PAGE_MAX_LIMIT = int(os.environ.get('HISTORY_PAGE_MAX_LIMIT', 1000))
+
+def encode_cursor(state):
+    """Курсор страницы: компактный JSON в base64url"""
+    raw = json.dumps(state, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(value):
+    """Разбор курсора страницы (ValueError, если он испорчен)"""
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        state = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Некорректный cursor: {e}')
+    if not isinstance(state, dict):
+        raise ValueError('Некорректный cursor')
+    if 'u' in state:
+        valid = _is_count(state['u'])
+    else:
+        valid = (isinstance(state.get('t'), (int, float)) and not isinstance(state['t'], bool)
+                 and math.isfinite(state['t']) and _is_count(state.get('n')))
+    if not valid:
+        raise ValueError('Некорректный cursor')
+    return state
+
+def _is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+def paginate_history(index, cutoff, limit, cursor=None):
+    """Страница истории новее cutoff в исходном порядке: (записи, курсор, всего)
+
+    Курсор привязан ко времени последней выданной записи (t) и числу уже
+    выданных записей с тем же временем (n), поэтому страницы не съезжают,
+    когда в историю добавляются новые записи или старые уходят из окна.
+    Записи без разбираемого времени идут после всех остальных (u - смещение).
+    """
+    epochs = index['series']['epoch']
+    unparsed = index['unparsed']
+    descending = index['descending']
+
+    lo = 0 if cutoff is None else search_epoch(epochs, cutoff)
+    hi = len(epochs)
+    total = hi - lo + len(unparsed)
+    unparsed_offset = 0
+
+    if cursor:
+        if 'u' in cursor:
+            lo = hi
+            unparsed_offset = int(cursor['u'])
+        elif descending:
+            hi = min(hi, search_epoch(epochs, float(cursor['t'])) - int(cursor['n']))
+        else:
+            lo = max(lo, search_epoch(epochs, float(cursor['t']), 'left') + int(cursor['n']))
+        hi = max(hi, lo)
+
+    if descending:
+        first = max(lo, hi - limit)
+        page = index_items(index, first, hi)[::-1]
+        last_pos = first
+    else:
+        page = index_items(index, lo, lo + limit)
+        last_pos = lo + len(page) - 1
+
+    if hi - lo > len(page):
+        epoch = int(epochs[last_pos])
+        if descending:
+            emitted = search_epoch(epochs, epoch) - last_pos
+        else:
+            emitted = last_pos - search_epoch(epochs, epoch, 'left') + 1
+        return page, {'t': epoch, 'n': emitted}, total
+
+    room = limit - len(page)
+    page = page + unparsed[unparsed_offset:unparsed_offset + room]
+    if unparsed_offset + room < len(unparsed):
+        return page, {'u': unparsed_offset + room}, total
+    return page, None, total
+
+def project_fields(items, fields):
+    """Оставляет в записях только запрошенные поля"""
+    return [{key: item[key] for key in fields if key in item} for item in items]
+
+def get_aggregate_history_index(region_code, region):
+    """Индекс истории региона из общего кэша (закодированная декодируется здесь)"""
+    history = region.get('history', [])
+    decode = decode_history_json if isinstance(history, ENCODED_JSON_TYPES) else None
+    return get_history_index(('aggregate', region_code), history, decode)
+
+def get_region_history_index(region_code):
+    """Индекс истории региона и версия данных: history_{code}.json или общий кэш"""
+    entry = get_cached_file_entry(f"history_{region_code}.json")
+    if entry and isinstance(entry['data'], dict):
+        history = entry['data'].get('history', [])
+        return get_history_index(('file', region_code), history), entry['version']
+
+    cached_data = get_cached_data()
+    if cached_data and region_code in cached_data:
+        index = get_aggregate_history_index(region_code, cached_data[region_code])
+        return index, get_cached_data_version(cached_data)
+
+    return None, None
+
+# === АГРЕГАТЫ ИСТОРИИ ДЛЯ ГРАФИКОВ ===
+# Сколько точек по умолчанию отдаем на график и минимальный размер корзины
+ROLLUP_DEFAULT_POINTS = int(os.environ.get('ROLLUP_DEFAULT_POINTS', 300))
+ROLLUP_MIN_BUCKET = int(os.environ.get('ROLLUP_MIN_BUCKET', 60))
+# Верхняя граница корзины (год): epoch // bucket считается в int64 колонках
+ROLLUP_MAX_BUCKET = 366 * 86400
+ROLLUP_CACHE_MAX_ENTRIES = int(os.environ.get('ROLLUP_CACHE_MAX_ENTRIES', 512))
+
+# (регион, версия данных, hours, bucket, начало окна) -> список корзин
+rollup_cache = OrderedDict()
+rollup_cache_lock = threading.Lock()
+
+def parse_duration(value):
+    """Длительность в секундах: '900', '15m', '1h', '1d' (ValueError, если не число)"""
+    value = str(value).strip().lower()
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    unit = 1
+    if value and value[-1] in units:
+        value, unit = value[:-1], units[value[-1]]
+    seconds = float(value) * unit
+    if not math.isfinite(seconds):
+        raise ValueError(f'Некорректная длительность: {value}')
+    return int(seconds)
+
+def _rollup_buckets(index, lo, hi, bucket):
+    """Корзины [{'epoch', 'count', 'stats': {поле: min/max/avg/last}}] по срезу колонок"""
+    if hi <= lo:
+        return []
+    series = index['series']
+
+    if np is None:
+        groups = OrderedDict()
+        for pos in range(lo, hi):
+            groups.setdefault(series['epoch'][pos] // bucket, []).append(pos)
+        result = []
+        for bucket_id, positions in groups.items():
+            first, last = positions[0], positions[-1] + 1
+            result.append({
+                'epoch': bucket_id * bucket,
+                'count': len(positions),
+                'stats': {field: series_aggregate(series[field], first, last) for field in SERIES_FIELDS}
+            })
+        return result
+
+    ids = series['epoch'][lo:hi] // bucket
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    counts = np.diff(np.r_[starts, len(ids)])
+    positions = np.arange(len(ids))
+
+    stats = {}
+    for field in SERIES_FIELDS:
+        column = series[field][lo:hi]
+        valid = ~np.isnan(column)
+        valid_counts = np.add.reduceat(valid.astype(np.int64), starts)
+        sums = np.add.reduceat(np.where(valid, column, 0.0), starts)
+        # fmin/fmax пропускают NaN; последняя позиция с непустым значением в корзине
+        mins = np.fmin.reduceat(column, starts)
+        maxs = np.fmax.reduceat(column, starts)
+        last_pos = np.maximum.reduceat(np.where(valid, positions, -1), starts)
+        stats[field] = (valid_counts, sums, mins, maxs, column[np.maximum(last_pos, 0)])
+
+    result = []
+    for i, start in enumerate(starts):
+        bucket_stats = {}
+        for field, (valid_counts, sums, mins, maxs, lasts) in stats.items():
+            if valid_counts[i]:
+                bucket_stats[field] = {
+                    'min': float(mins[i]),
+                    'max': float(maxs[i]),
+                    'avg': float(sums[i] / valid_counts[i]),
+                    'last': float(lasts[i])
+                }
+            else:
+                bucket_stats[field] = None
+        result.append({
+            'epoch': int(ids[start]) * bucket,
+            'count': int(counts[i]),
+            'stats': bucket_stats
+        })
+    return result
+
+def get_history_rollup(region_code, index, version, hours, bucket):
+    """Корзины истории за последние hours часов (кэшируются до обновления данных)"""
+    # Окно выравниваем по границе корзины: в пределах одной корзины ответ не меняется
+    window_start = int(time.time() - hours * 3600) // bucket
+    key = (region_code, version, id(index), hours, bucket, window_start)
+
+    with rollup_cache_lock:
+        buckets = rollup_cache.get(key)
+        if buckets is not None:
+            rollup_cache.move_to_end(key)
+            return buckets
+
+    lo, hi = series_range(index, window_start * bucket - 1)
+    buckets = _rollup_buckets(index, lo, hi, bucket)
+    for item in buckets:
+        item['start'] = datetime.fromtimestamp(item['epoch']).isoformat()
+
+    with rollup_cache_lock:
+        rollup_cache[key] = buckets
+        while len(rollup_cache) > ROLLUP_CACHE_MAX_ENTRIES:
+            rollup_cache.popitem(last=False)
+    return buckets
+
+# === СВОДКА РЕГИОНОВ ===
+# Список для /api/regions строится один раз на объект cached_data (версию)
+# вместе с заранее отсортированными порядками по каждому полю. Сортировка,
+# фильтры и worst=K в запросе - проход по готовому порядку без пересборки.
+REGION_SORT_FIELDS = ('code', 'name', 'total_bs', 'base_layer_percentage', 'power_problems')
+
+# Текущая сводка: {'source': cached_data, 'regions': [...], 'orders': {...}}
+region_summary_state = {'summary': None}
+region_summary_lock = threading.Lock()
+
+def _region_sort_key(region, field):
+    """Ключ сортировки: пустые и нечисловые значения всегда в конце"""
+    if field in ('code', 'name'):
+        return (False, str(region[field]))
+    value = _stat_value(region, field)
+    return (math.isnan(value), 0.0 if math.isnan(value) else value)
+
+def build_region_summary(cached_data):
+    """Список регионов и порядки сортировки (индексы в списке) по полям"""
+    regions = []
+    for region_code, data in cached_data.items():
+        if region_code != '_meta':
+            current = data.get('current', {})
+            stats = current.get('stats', {})
+            regions.append({
+                'code': region_code,
+                'name': current.get('region_name', region_code),
+                'total_bs': stats.get('total_bs', 0),
+                'base_layer_percentage': stats.get('base_layer_percentage', 0),
+                'power_problems': stats.get('power_problems', 0),
+                'last_updated': current.get('timestamp', '00:00:00'),
+                'has_history': region_has_history(data)
+            })
+
+    orders = {}
+    positions = range(len(regions))
+    for field in REGION_SORT_FIELDS:
+        keys = [_region_sort_key(region, field) for region in regions]
+        ascending = sorted(positions, key=lambda i: (keys[i], regions[i]['code']))
+        present = [i for i in ascending if not keys[i][0]]
+        missing = ascending[len(present):]
+        orders[(field, False)] = ascending
+        orders[(field, True)] = present[::-1] + missing
+
+    # Худшие: меньше базовый слой, при равенстве - больше проблем с питанием
+    base_keys = [_region_sort_key(region, 'base_layer_percentage') for region in regions]
+    power_keys = [_region_sort_key(region, 'power_problems') for region in regions]
+    orders['worst'] = sorted(positions, key=lambda i: (base_keys[i], -power_keys[i][1], regions[i]['code']))
+
+    return {'source': cached_data, 'regions': regions, 'orders': orders}
+
+def get_region_summary(cached_data):
+    """Сводка для данного cached_data; пересобирается только при смене данных"""
+    summary = region_summary_state['summary']
+    if summary is not None and summary['source'] is cached_data:
+        return summary
+
+    with region_summary_lock:
+        summary = region_summary_state['summary']
+        if summary is None or summary['source'] is not cached_data:
+            summary = build_region_summary(cached_data)
+            # Запоминаем только сводку текущего кэша, а не устаревшего объекта
+            if cache['data'] is cached_data:
+                region_summary_state['summary'] = summary
+    return summary
+
+def select_regions(summary, sort=None, descending=False, worst=None,
+                   min_power_problems=None, max_base_layer_percentage=None, limit=None):
+    """Регионы из сводки с фильтрами, сортировкой и ограничением количества"""
+    regions = summary['regions']
+    if worst is not None:
+        order = summary['orders']['worst']
+        limit = worst if limit is None else min(limit, worst)
+    elif sort is not None:
+        order = summary['orders'][(sort, descending)]
+    else:
+        order = range(len(regions))
+
+    result = []
+    for i in order:
+        if limit is not None and len(result) >= limit:
+            break
+        region = regions[i]
+        if min_power_problems is not None and not _stat_value(region, 'power_problems') >= min_power_problems:
+            continue
+        if (max_base_layer_percentage is not None
+                and not _stat_value(region, 'base_layer_percentage') <= max_base_layer_percentage):
+            continue
+        result.append(region)
+    return result
+
+# === ИНДЕКС БАЗОВЫХ СТАНЦИЙ ===
+# Тексты base_layer и non_priority текущих снимков регионов разбираются в
+# записи (BS, технология, статус) один раз на объект cached_data. Поверх них -
+# обратный индекс BS -> записи и отсортированный список id для поиска по
+# префиксу через bisect, так что /api/bs отвечает из памяти.
+BS_SEARCH_DEFAULT_LIMIT = 20
+BS_SEARCH_MAX_LIMIT = int(os.environ.get('BS_SEARCH_MAX_LIMIT', 200))
+BS_TEXT_FIELDS = ('base_layer', 'non_priority')
+
+# Заголовок раздела: "Недоступно LTE1800:"
+_BS_SECTION = re.compile(r'^(?P<status>\S+)\s+(?P<technology>[^:]+?):$')
+# Строка раздела: "1) BS1001"
+_BS_ITEM = re.compile(r'^\d+[).]\s*(?P<bs_id>\S+)')
+
+# Текущий индекс: {'source': cached_data, 'by_id': {ID: [записи]}, 'ids': [...]}
+bs_index_state = {'index': None}
+bs_index_lock = threading.Lock()
+
+def normalize_bs_id(bs_id):
+    return bs_id.strip().upper()
+
+def parse_bs_text(text):
+    """Записи (bs_id, технология, статус) из текста вида "Недоступно LTE1800:\\n1) BS1001" """
+    records = []
+    section = None
+    for line in (text or '').splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        item = _BS_ITEM.match(line)
+        if item and section:
+            records.append((item.group('bs_id'), section[1], section[0]))
+            continue
+        header = _BS_SECTION.match(line)
+        section = (header.group('status'), header.group('technology').strip()) if header else None
+    return records
+
+def build_bs_index(cached_data):
+    """Обратный индекс BS по текущим снимкам всех регионов"""
+    by_id = {}
+    for region_code, region in cached_data.items():
+        if region_code == '_meta' or not isinstance(region, dict):
+            continue
+        current = region.get('current') or {}
+        for source in BS_TEXT_FIELDS:
+            for bs_id, technology, status in parse_bs_text(current.get(source)):
+                by_id.setdefault(normalize_bs_id(bs_id), []).append({
+                    'bs_id': bs_id,
+                    'technology': technology,
+                    'status': status,
+                    'source': source,
+                    'region_code': region_code,
+                    'region_name': current.get('region_name', region_code),
+                    'timestamp': current.get('full_timestamp') or current.get('timestamp')
+                })
+    return {'source': cached_data, 'by_id': by_id, 'ids': sorted(by_id)}
+
+def get_bs_index(cached_data):
+    """Индекс BS для данного cached_data; пересобирается только при смене данных"""
+    index = bs_index_state['index']
+    if index is not None and index['source'] is cached_data:
+        return index
+
+    with bs_index_lock:
+        index = bs_index_state['index']
+        if index is None or index['source'] is not cached_data:
+            index = build_bs_index(cached_data)
+            if cache['data'] is cached_data:
+                bs_index_state['index'] = index
+    return index
+
+def search_bs_prefix(index, prefix, limit):
+    """id BS с данным префиксом по порядку: (id, есть ли еще)"""
+    ids = index['ids']
+    prefix = normalize_bs_id(prefix)
+    start = bisect.bisect_left(ids, prefix)
+    found = []
+    for bs_id in itertools.islice(ids, start, None):
+        if not bs_id.startswith(prefix):
+            return found, False
+        if len(found) == limit:
+            return found, True
+        found.append(bs_id)
+    return found, False
+
+# === PUSH ОБНОВЛЕНИЙ РЕГИОНОВ (SSE) ===
+# /api/stream?regions=77,50 - одно долгое соединение вместо опроса /api/region.
+# Событие уходит, только когда после обновления cached_data.json изменился
+# снимок current региона. У подписчика не очередь, а последнее событие по
+# каждому региону: медленный клиент получает свежее состояние без догонялок,
+# а память на подписчика ограничена числом регионов.
+# Синхронный воркер gunicorn занят соединением целиком, поэтому без gevent
+# поток выключен (0 - /api/stream отвечает 503). Если включить явно, поток
+# закрывается раньше timeout воркера, и клиент переподключается
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 1000 if ASYNC_MODE == 'gevent' else 0))
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', 15))
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', 3600 if ASYNC_MODE == 'gevent' else 25))
+SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', 5000))
+
+# id -> {'regions': set или None (все), 'pending': {код: событие}, 'wakeup': Event}
+stream_subscribers = {}
+stream_lock = threading.Lock()
+
+def region_event(region_code, current):
+    """Компактное событие региона: без текстов, только время и stats"""
     return {
-        'success': False,
-        'error': 'Неверные учетные данные',
-        'error_code': 'INVALID_CREDENTIALS'
+        'code': region_code,
+        'name': current.get('region_name', region_code),
+        'timestamp': current.get('full_timestamp') or current.get('timestamp'),
+        'stats': current.get('stats', {})
+    }
+
+def publish_region_changes(old_data, new_data):
+    """Раздает подписчикам регионы, у которых изменился current"""
+    if old_data is new_data or not isinstance(new_data, dict) or not stream_subscribers:
+        return
+
+    old_data = old_data if isinstance(old_data, dict) else {}
+    changed = []
+    for region_code, region in new_data.items():
+        if region_code == '_meta' or not isinstance(region, dict):
+            continue
+        current = region.get('current') or {}
+        previous = old_data.get(region_code)
+        if not isinstance(previous, dict) or previous.get('current') != current:
+            changed.append((region_code, region_event(region_code, current)))
+    if not changed:
+        return
+
+    inc_counter('dostupnost_stream_changes_total', value=len(changed))
+    with stream_lock:
+        for subscriber in stream_subscribers.values():
+            wanted = subscriber['regions']
+            for region_code, event in changed:
+                if wanted is None or region_code in wanted:
+                    if region_code in subscriber['pending']:
+                        inc_counter('dostupnost_stream_coalesced_total')
+                    subscriber['pending'][region_code] = event
+            if subscriber['pending']:
+                subscriber['wakeup'].set()
+
+def subscribe_stream(region_codes):
+    """Регистрирует подписчика (None, если достигнут SSE_MAX_SUBSCRIBERS)"""
+    subscriber = {
+        'id': uuid.uuid4().hex,
+        'regions': region_codes,
+        'pending': OrderedDict(),
+        'wakeup': threading.Event()
     }
+    with stream_lock:
+        if len(stream_subscribers) >= SSE_MAX_SUBSCRIBERS:
+            return None
+        stream_subscribers[subscriber['id']] = subscriber
+    return subscriber
+
+def unsubscribe_stream(subscriber):
+    with stream_lock:
+        stream_subscribers.pop(subscriber['id'], None)
 
-def fetch_from_github(filename):
-    """Загружает данные из GitHub"""
+def take_stream_events(subscriber):
+    """Забирает накопленные события подписчика"""
+    with stream_lock:
+        events = list(subscriber['pending'].values())
+        subscriber['pending'].clear()
+        subscriber['wakeup'].clear()
+    return events
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+def get_stream_status():
+    """Состояние SSE для мониторинга"""
+    with stream_lock:
+        return {
+            'subscribers': len(stream_subscribers),
+            'max_subscribers': SSE_MAX_SUBSCRIBERS,
+            'pending_events': sum(len(item['pending']) for item in stream_subscribers.values())
+        }
+
+# === ФОНОВЫЙ ПРОГРЕВ КЭША ===
+# Если включен, cached_data.json и файлы регионов загружаются при старте и
+# обновляются по расписанию, а обработчики запросов читают только память.
+# Интервал должен быть меньше CACHE_TIMEOUT и TTL файлов (FILE_CACHE_TTL).
+CACHE_WARMER_ENABLED = os.environ.get('CACHE_WARMER_ENABLED', '').lower() in ('1', 'true', 'yes')
+CACHE_WARMER_INTERVAL = float(os.environ.get('CACHE_WARMER_INTERVAL', 30))
+
+warmer_status = {
+    'enabled': CACHE_WARMER_ENABLED,
+    'running': False,
+    'last_refresh': None,
+    'last_duration': None,
+    'last_error': None,
+    'last_success': None,
+    'refresh_count': 0,
+    'error_count': 0,
+    'files': 0,
+    'leader': None
+}
+warmer_started_at = None
+warmer_lock_file = None
+
+def is_warmer_leader():
+    """В GitHub из прогрева ходит один процесс - держатель flock в SHARED_CACHE_DIR"""
+    global warmer_lock_file
+    if not SHARED_CACHE_DIR or fcntl is None or warmer_lock_file is not None:
+        return True
+
+    handle = open(os.path.join(SHARED_CACHE_DIR, '.warmer.lock'), 'a')
     try:
-        url = f"{GITHUB_RAW_BASE}{filename}"
-        response = requests.get(url, timeout=10)
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
 
-        if response.status_code == 200:
-            return response.json()
+    warmer_lock_file = handle
+    print(f"👑 Процесс {os.getpid()} ведет прогрев общего кэша")
+    return True
+
+def run_periodically(name, interval, fn):
+    """Запускает fn в фоновом daemon-потоке каждые interval секунд"""
+    def loop():
+        while True:
+            try:
+                fn()
+            except Exception as e:
+                print(f"❌ Фоновая задача {name}: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return thread
+
+def warm_cache():
+    """Один проход прогрева: cached_data.json и файлы всех регионов"""
+    started = time.monotonic()
+    warmer_status['running'] = True
+    errors = []
+    files = 0
+
+    # Ведущий процесс всегда спрашивает GitHub, остальные читают его снимки
+    leader = is_warmer_leader()
+    warmer_status['leader'] = leader
+    shared_max_age = 0 if leader else CACHE_WARMER_INTERVAL * 3
+
+    try:
+        with cache_refresh_lock:
+            if not _refresh_cached_data(shared_max_age):
+                errors.append(f"cached_data.json: {cache['last_error']}")
+
+        region_codes = [code for code in list(cache['data'] or {}) if code != '_meta']
+        now = time.monotonic()
+        jobs = []
+        for region_code in region_codes:
+            for filename in (f"region_{region_code}.json", f"history_{region_code}.json"):
+                # Про отсутствующие файлы уже знаем - ждем окончания отрицательного кэша
+                missing_until = missing_files.get(filename)
+                if missing_until is None or missing_until <= now:
+                    jobs.append((region_code, filename))
+
+        def refresh_file(job):
+            return get_cached_file_entry(job[1], force=True, shared_max_age=shared_max_age)
+
+        with_history_file = set()
+        for (region_code, filename), entry in zip(jobs, upstream_executor.map(refresh_file, jobs)):
+            if entry:
+                files += 1
+                if filename.startswith('history_') and isinstance(entry['data'], dict):
+                    with_history_file.add(region_code)
+                    get_history_index(('file', region_code), entry['data'].get('history', []))
+            elif filename not in missing_files:
+                errors.append(filename)
+
+        # Индекс и колонки истории строим сразу после обновления, а не в запросе.
+        # Историю из общего кэша декодируем только там, где нет history_{code}.json
+        for region_code in region_codes:
+            region = cache['data'].get(region_code)
+            if isinstance(region, dict) and region_code not in with_history_file:
+                get_aggregate_history_index(region_code, region)
+        if cache['data']:
+            get_region_summary(cache['data'])
+            get_bs_index(cache['data'])
+    finally:
+        warmer_status['running'] = False
+        warmer_status['last_refresh'] = datetime.now().isoformat()
+        warmer_status['last_duration'] = round(time.monotonic() - started, 3)
+        warmer_status['refresh_count'] += 1
+        warmer_status['files'] = files
+
+    if errors:
+        warmer_status['error_count'] += 1
+        warmer_status['last_error'] = f"Не удалось обновить: {', '.join(errors[:5])}"
+        print(f"⚠️ Прогрев кэша: {warmer_status['last_error']}")
+    else:
+        warmer_status['last_error'] = None
+        warmer_status['last_success'] = warmer_status['last_refresh']
+
+def start_cache_warmer():
+    """Запускает фоновый прогрев кэша (один раз на процесс)"""
+    global warmer_started_at
+    if warmer_started_at is not None:
+        return
+    warmer_started_at = time.monotonic()
+    run_periodically('cache-warmer', CACHE_WARMER_INTERVAL, warm_cache)
+    print(f"🔥 Фоновый прогрев кэша запущен (каждые {CACHE_WARMER_INTERVAL:g}с)")
+
+def get_warmer_status():
+    """Состояние фонового прогрева для мониторинга и алертов"""
+    status = dict(warmer_status)
+    status['interval'] = CACHE_WARMER_INTERVAL
+    if CACHE_WARMER_ENABLED:
+        # Прогрев считается зависшим, если не завершался дольше трех интервалов
+        last = warmer_status['last_success'] or warmer_status['last_refresh']
+        if last:
+            age = (datetime.now() - datetime.fromisoformat(last)).total_seconds()
+        elif warmer_started_at is not None:
+            age = time.monotonic() - warmer_started_at
         else:
-            print(f"⚠️ Файл {filename} не найден: {response.status_code}")
-            return None
+            age = 0
+        status['healthy'] = age < CACHE_WARMER_INTERVAL * 3 and warmer_status['last_error'] is None
+    return status
+
+# === ФОНОВЫЕ ПРОВЕРКИ ДОСТУПНОСТИ ===
+# LDAP /health и GitHub проверяются в фоне, каждый в своем потоке, так что
+# медленный LDAP не задерживает проверку GitHub. Эндпоинты здоровья отдают
+# последний результат с его возрастом и задержкой и никогда не ждут сеть сами:
+# до первой проверки статус 'unknown'. Потоки запускаются при первом обращении
+# к эндпоинтам здоровья.
+HEALTH_PROBE_INTERVAL = float(os.environ.get('HEALTH_PROBE_INTERVAL', 30))
+HEALTH_PROBE_TIMEOUT = float(os.environ.get('HEALTH_PROBE_TIMEOUT', 3))
+
+health_probes = {
+    'ldap': {'status': 'unknown'},
+    'github': {'status': 'unknown'}
+}
+health_prober_lock = threading.Lock()
+health_prober_started = False
+
+def _probe(session, method, url):
+    """Один запрос проверки доступности: статус, код ответа, задержка"""
+    started = time.monotonic()
+    result = {'checked_at': datetime.now().isoformat(), 'checked_mono': started}
+    try:
+        response = session.request(method, url, timeout=HEALTH_PROBE_TIMEOUT)
+        result.update({
+            'status': 'available' if response.status_code == 200 else 'unavailable',
+            'status_code': response.status_code,
+            'error': None
+        })
     except Exception as e:
-        print(f"❌ Ошибка загрузки {filename}: {e}")
-        return None
+        result.update({'status': 'unavailable', 'status_code': None, 'error': str(e)})
+    result['latency'] = round(time.monotonic() - started, 3)
+    return result
 
-def get_cached_data():
-    """Получает данные с кэшированием"""
-    global cache
+def probe_ldap():
+    health_probes['ldap'] = _probe(
+        ldap_session, 'GET', LDAP_SERVER_URL.replace('/api/ldap/auth', '/health')
+    )
 
-    now = datetime.now()
-    if (now - cache['timestamp']).seconds < CACHE_TIMEOUT and 'data' in cache:
-        return cache['data']
+def probe_github():
+    health_probes['github'] = _probe(upstream_session, 'HEAD', f"{GITHUB_RAW_BASE}cached_data.json")
+
+def start_health_prober():
+    """Запускает фоновые проверки, по потоку на цель (один раз на процесс)"""
+    global health_prober_started
+    with health_prober_lock:
+        if health_prober_started:
+            return
+        health_prober_started = True
+    if LDAP_SERVER_URL:
+        run_periodically('health-prober-ldap', HEALTH_PROBE_INTERVAL, probe_ldap)
+    else:
+        health_probes['ldap'] = {'status': 'not_configured'}
+    run_periodically('health-prober-github', HEALTH_PROBE_INTERVAL, probe_github)
+
+def get_probe_result(name):
+    """Последний результат проверки с возрастом, без ожидания сети"""
+    start_health_prober()
+
+    result = dict(health_probes[name])
+    checked = result.pop('checked_mono', None)
+    result['age_seconds'] = round(time.monotonic() - checked, 1) if checked is not None else None
+    return result
+
+# === ETAG ДЛЯ ОТВЕТОВ API ===
+def make_etag(version, *parts):
+    """ETag из версии данных, пути с параметрами и доп. частей
+
+    Отдается слабым (W/): identity, gzip и br варианты одного ответа
+    совпадают по смыслу, но не побайтно.
+    """
+    key = '|'.join(str(part) for part in (version, request.full_path) + parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:24]
+
+# === КЭШ ГОТОВЫХ ОТВЕТОВ ===
+# Тела ответов по ETag (= эндпоинт + параметры + версия данных): JSON-байты
+# и их gzip/brotli варианты. Запрос к горячему региону - поиск в словаре.
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+RESPONSE_COMPRESS_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESS_MIN_SIZE', 1024))
+
+# etag -> {'identity': bytes, 'gzip': bytes, 'br': bytes}
+response_cache = OrderedDict()
+response_cache_lock = threading.Lock()
+response_cache_stats = {
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0,
+    'bytes': 0
+}
 
-    # Загружаем данные
-    data = fetch_from_github("cached_data.json")
-    if data:
-        cache['data'] = data
-        cache['timestamp'] = now
+def _encode_body(body):
+    """Варианты тела ответа: как есть, gzip и (если есть модуль) brotli"""
+    variants = {'identity': body}
+    if len(body) >= RESPONSE_COMPRESS_MIN_SIZE:
+        variants['gzip'] = gzip.compress(body, compresslevel=6)
+        if brotli is not None:
+            variants['br'] = brotli.compress(body, quality=5)
+    return variants
 
-    return data
+def cached_body_response(etag, build_response):
+    """Готовый ответ из кэша тел или построенный и сохраненный (только 200)"""
+    with response_cache_lock:
+        variants = response_cache.get(etag)
+        if variants is not None:
+            response_cache.move_to_end(etag)
+            response_cache_stats['hits'] += 1
+        else:
+            response_cache_stats['misses'] += 1
+
+    if variants is None:
+        response = make_response(build_response())
+        if response.status_code != 200:
+            return response
+
+        variants = _encode_body(response.get_data())
+        size = sum(len(body) for body in variants.values())
+        with response_cache_lock:
+            old = response_cache.pop(etag, None)
+            if old:
+                response_cache_stats['bytes'] -= sum(len(body) for body in old.values())
+            response_cache[etag] = variants
+            response_cache_stats['bytes'] += size
+            while response_cache and (len(response_cache) > RESPONSE_CACHE_MAX_ENTRIES
+                                      or response_cache_stats['bytes'] > RESPONSE_CACHE_MAX_BYTES):
+                _, evicted = response_cache.popitem(last=False)
+                response_cache_stats['bytes'] -= sum(len(body) for body in evicted.values())
+                response_cache_stats['evictions'] += 1
+
+    encoding = 'identity'
+    accepted = request.accept_encodings
+    if 'br' in variants and accepted['br']:
+        encoding = 'br'
+    elif 'gzip' in variants and accepted['gzip']:
+        encoding = 'gzip'
+
+    response = app.response_class(variants[encoding], mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def get_response_cache_stats():
+    """Статистика кэша готовых ответов для мониторинга"""
+    with response_cache_lock:
+        stats = dict(response_cache_stats)
+        stats['entries'] = len(response_cache)
+    stats['brotli'] = brotli is not None
+    return stats
+
+def versioned_response(version, build_response, *etag_parts):
+    """Ответ с ETag от версии данных; при совпадении If-None-Match - 304 без тела
+
+    build_response вызывается, только если тела нет в кэше готовых ответов.
+    Без версии (тестовые данные) отвечаем как обычно, без ETag и кэша.
+    """
+    if version is None:
+        return build_response()
+
+    etag = make_etag(version, *etag_parts)
+    # If-None-Match сравнивается слабо: подходит и W/"...", и "..." (после прокси)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = cached_body_response(etag, build_response)
+    response.set_etag(etag, weak=True)
+    return response
+
+def parse_since(value):
+    """Параметр since: epoch секунды или ISO-время"""
+    try:
+        return float(value)
+    except ValueError:
+        epoch = parse_history_time(value)
+        if epoch is None:
+            raise ValueError(f'Некорректный since: {value}')
+        return epoch
 
 @app.route('/api/test', methods=['GET'])
 def test_connection():
@@ -179,24 +2454,31 @@ def test_connection():
         'features': ['current_data', 'full_history', 'historical_view', 'ldap_auth'],
         'auth_modes': ['ldap', 'fallback', 'mixed'],
         'current_auth_mode': AUTH_MODE,
-        'ldap_configured': bool(LDAP_SERVER_URL)
+        'ldap_configured': bool(LDAP_SERVER_URL),
+        'token_required': AUTH_TOKEN_REQUIRED,
+        'async_mode': ASYNC_MODE or 'sync'
     })
 
 @app.route('/api/region/<region_code>', methods=['GET'])
+@token_auth
+@rate_limit('region')
 def get_region_data(region_code):
     """Получение текущих данных региона"""
     try:
         # Пробуем загрузить конкретный файл региона
         filename = f"region_{region_code}.json"
-        data = fetch_from_github(filename)
+        entry = get_cached_file_entry(filename)
 
-        if data:
-            return jsonify(data)
+        if entry and entry['data']:
+            return versioned_response(entry['version'], lambda: jsonify(entry['data']))
 
         # Если нет отдельного файла, ищем в общем кэше
         cached_data = get_cached_data()
         if cached_data and region_code in cached_data:
-            return jsonify(cached_data[region_code]['current'])
+            return versioned_response(
+                get_cached_data_version(cached_data),
+                lambda: jsonify(cached_data[region_code]['current'])
+            )
 
         # Если данных нет, возвращаем mock
         return jsonify({
@@ -223,72 +2505,255 @@ def get_region_data(region_code):
             'region_code': region_code
         }), 500
 
+# === ПАКЕТНЫЙ ЗАПРОС РЕГИОНОВ ===
+# Из GitHub за один пакетный запрос загружается не больше
+# BATCH_MAX_UPSTREAM_FETCHES файлов регионов, и только для кодов, которые есть
+# в cached_data.json: остальные промахи отдаются из общего кэша или попадают в
+# missing, так что произвольные коды в запросе не превращаются в запросы к GitHub.
+BATCH_MAX_CODES = int(os.environ.get('BATCH_MAX_CODES', 100))
+BATCH_MAX_UPSTREAM_FETCHES = int(os.environ.get('BATCH_MAX_UPSTREAM_FETCHES', 8))
+
+@app.route('/api/regions/batch', methods=['GET', 'POST'])
+@token_auth
+@rate_limit('batch')
+def get_regions_batch():
+    """Текущие данные нескольких регионов за один запрос
+
+    GET ?codes=77,50,23 или POST {"codes": ["77", "50"]}. Отсутствующие в кэше
+    файлы известных регионов загружаются параллельно в ограниченном пуле потоков
+    (не больше BATCH_MAX_UPSTREAM_FETCHES), остальные берутся из cached_data.json.
+    """
+    try:
+        if request.method == 'POST':
+            codes = (request.get_json(silent=True) or {}).get('codes', [])
+        else:
+            codes = request.args.get('codes', '').split(',')
+
+        if not isinstance(codes, list):
+            codes = []
+        codes = list(dict.fromkeys(str(code).strip() for code in codes if str(code).strip()))
+
+        if not codes:
+            return jsonify({
+                'success': False,
+                'error': 'Требуется список кодов регионов (codes)',
+                'error_code': 'MISSING_CODES'
+            }), 400
+        if len(codes) > BATCH_MAX_CODES:
+            return jsonify({
+                'success': False,
+                'error': f'Слишком много регионов в запросе (максимум {BATCH_MAX_CODES})',
+                'error_code': 'TOO_MANY_CODES'
+            }), 400
+
+        cached_data = get_cached_data() or {}
+
+        def is_known(code):
+            # Без cached_data.json список регионов неизвестен - остается только лимит
+            return not cached_data or (code in cached_data and code != '_meta')
+
+        # Загружаем параллельно только то, чего нет в памяти, и не больше лимита
+        entries = {}
+        to_fetch = []
+        for code in codes:
+            filename = f"region_{code}.json"
+            if is_file_cached(filename):
+                entries[code] = get_cached_file_entry(filename)
+            elif is_known(code) and len(to_fetch) < BATCH_MAX_UPSTREAM_FETCHES:
+                to_fetch.append(code)
+        entries.update(zip(to_fetch, upstream_executor.map(
+            lambda code: get_cached_file_entry(f"region_{code}.json"), to_fetch
+        )))
+
+        regions = {}
+        versions = []
+        missing = []
+        for code in codes:
+            entry = entries.get(code)
+            if entry and entry['data']:
+                regions[code] = entry['data']
+                versions.append(f"{code}:{entry['version']}")
+                continue
+
+            # Если нет отдельного файла (или он не загружался), ищем в общем кэше
+            if code in cached_data and code != '_meta':
+                regions[code] = cached_data[code]['current']
+                versions.append(f"{code}:{get_cached_data_version(cached_data)}")
+            else:
+                missing.append(code)
+                versions.append(f"{code}:-")
+
+        def build_response():
+            return jsonify({
+                'success': True,
+                'regions': regions,
+                'missing': missing,
+                'count': len(regions),
+                'timestamp': datetime.now().isoformat()
+            })
+
+        return versioned_response(hashlib.sha1('|'.join(versions).encode('utf-8')).hexdigest(), build_response)
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/region/<region_code>/history', methods=['GET'])
+@token_auth
+@rate_limit('history')
 def get_region_history(region_code):
-    """Получение истории региона (список записей)"""
+    """Получение истории региона (список записей)
+
+    Необязательно: limit/cursor - постраничная выдача, fields - список полей записи,
+    since - только записи новее этого времени (epoch или ISO).
+    """
     try:
         # Получаем параметр hours
         hours = int(request.args.get('hours', 24))
 
+        try:
+            limit = request.args.get('limit')
+            limit = min(max(int(limit), 1), HISTORY_PAGE_MAX_LIMIT) if limit is not None else None
+            cursor = request.args.get('cursor')
+            cursor = decode_cursor(cursor) if cursor else None
+            since = request.args.get('since')
+            since = parse_since(since) if since else None
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f'Некорректные параметры страницы: {e}',
+                'region_code': region_code
+            }), 400
+        if cursor and limit is None:
+            limit = HISTORY_PAGE_MAX_LIMIT
+        fields = [field for field in request.args.get('fields', '').split(',') if field]
+
         # Пробуем загрузить файл истории
         filename = f"history_{region_code}.json"
-        data = fetch_from_github(filename)
+        entry = get_cached_file_entry(filename)
 
-        if data:
-            # Фильтруем по времени если нужно
-            if hours < 24:
-                cutoff_time = datetime.now() - timedelta(hours=hours)
-                filtered_history = []
-                for item in data.get('history', []):
-                    try:
-                        item_time = datetime.fromisoformat(item.get('full_timestamp', '2000-01-01').replace('Z', '+00:00'))
-                        if item_time > cutoff_time:
-                            filtered_history.append(item)
-                    except:
-                        filtered_history.append(item)
-
-                data['history'] = filtered_history
-                data['count'] = len(filtered_history)
-
-            return jsonify(data)
+        if entry and entry['data']:
+            data = entry['data']
+            version = entry['version']
+            # Копия: распарсенный объект переиспользуется между запросами (304)
+            response_data = dict(data)
+            history = data.get('history', [])
 
-        # Если файла истории нет, ищем в кэше
-        cached_data = get_cached_data()
-        if cached_data and region_code in cached_data:
-            history = cached_data[region_code].get('history', [])
-
-            # Фильтруем по времени если нужно
-            if hours < 24:
-                cutoff_time = datetime.now() - timedelta(hours=hours)
-                filtered_history = []
-                for item in history:
-                    try:
-                        item_time = datetime.fromisoformat(item.get('full_timestamp', '2000-01-01').replace('Z', '+00:00'))
-                        if item_time > cutoff_time:
-                            filtered_history.append(item)
-                    except:
-                        filtered_history.append(item)
-
-                history = filtered_history
+            def load_index():
+                return get_history_index(('file', region_code), history)
+        else:
+            # Если файла истории нет, ищем в кэше
+            cached_data = get_cached_data()
+            if not cached_data or region_code not in cached_data:
+                # Если истории нет, возвращаем пустую
+                return jsonify({
+                    'success': True,
+                    'region_code': region_code,
+                    'history': [],
+                    'count': 0,
+                    'timestamp': datetime.now().isoformat(),
+                    'message': 'История пока пуста'
+                })
 
-            return jsonify({
+            # Историю общего кэша декодируем только при сборке ответа (не для 304)
+            region = cached_data[region_code]
+            history = None
+            version = get_cached_data_version(cached_data)
+            response_data = {
                 'success': True,
                 'region_code': region_code,
-                'history': history,
-                'count': len(history),
                 'timestamp': datetime.now().isoformat(),
                 'message': 'Полная история с данными'
-            })
+            }
 
-        # Если истории нет, возвращаем пустую
+            def load_index():
+                return get_aggregate_history_index(region_code, region)
+
+        # Фильтруем по времени если нужно
+        cutoff = time.time() - hours * 3600 if hours < 24 else None
+        if since is not None:
+            cutoff = since if cutoff is None else max(cutoff, since)
+
+        def build_response():
+            history_page = history
+            if limit is not None:
+                history_page, next_cursor, total = paginate_history(load_index(), cutoff, limit, cursor)
+                response_data['total'] = total
+                response_data['has_more'] = next_cursor is not None
+                response_data['next_cursor'] = encode_cursor(next_cursor) if next_cursor else None
+            elif cutoff is not None:
+                history_page = history_since(load_index(), cutoff)
+            elif history is None:
+                history_page = load_index()['history']
+            elif not fields:
+                return jsonify(response_data)
+
+            if fields:
+                history_page = project_fields(history_page, fields)
+
+            response_data['history'] = history_page
+            response_data['count'] = len(history_page)
+            return jsonify(response_data)
+
+        # Окно hours сдвигается со временем - ETag меняется раз в минуту
+        window = int(time.time() // 60) if hours < 24 else None
+        return versioned_response(version, build_response, window)
+
+    except Exception as e:
         return jsonify({
-            'success': True,
-            'region_code': region_code,
-            'history': [],
-            'count': 0,
-            'timestamp': datetime.now().isoformat(),
-            'message': 'История пока пуста'
-        })
+            'success': False,
+            'error': str(e),
+            'region_code': region_code
+        }), 500
+
+@app.route('/api/region/<region_code>/history/rollup', methods=['GET'])
+@token_auth
+@rate_limit('rollup')
+def get_region_history_rollup(region_code):
+    """Агрегаты истории региона по корзинам времени (min/max/avg/last для графиков)"""
+    try:
+        try:
+            hours = int(request.args.get('hours', 24))
+            bucket = request.args.get('bucket')
+            if bucket is None:
+                bucket = hours * 3600 // ROLLUP_DEFAULT_POINTS
+            else:
+                bucket = parse_duration(bucket)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'Параметры hours и bucket должны быть числами (bucket: 900, 15m, 1h)',
+                'region_code': region_code
+            }), 400
+
+        if hours <= 0:
+            return jsonify({
+                'success': False,
+                'error': 'Параметр hours должен быть больше нуля',
+                'region_code': region_code
+            }), 400
+        # Корзина больше окна все равно дает одну точку
+        bucket = min(max(bucket, ROLLUP_MIN_BUCKET), hours * 3600, ROLLUP_MAX_BUCKET)
+
+        index, version = get_region_history_index(region_code)
+
+        def build_response():
+            buckets = get_history_rollup(region_code, index, version, hours, bucket) if index else []
+            return jsonify({
+                'success': True,
+                'region_code': region_code,
+                'hours': hours,
+                'bucket': bucket,
+                'fields': list(SERIES_FIELDS),
+                'buckets': buckets,
+                'count': len(buckets),
+                'timestamp': datetime.now().isoformat()
+            })
+
+        window_start = int(time.time() - hours * 3600) // bucket
+        return versioned_response(version if index else None, build_response, window_start)
 
     except Exception as e:
         return jsonify({
@@ -298,15 +2763,18 @@ def get_region_history(region_code):
         }), 500
 
 @app.route('/api/region/<region_code>/history/<timestamp>', methods=['GET'])
+@token_auth
+@rate_limit('historical')
 def get_historical_data(region_code, timestamp):
     """Получение данных региона на конкретный момент времени"""
     try:
         # Преобразуем timestamp из URL в нормальный формат
+        url_timestamp = timestamp
         timestamp = timestamp.replace('-', ':').replace('T', ' ')
 
         # Сначала пробуем загрузить конкретный файл исторических данных
         filename = f"history_{region_code}_{timestamp}.json"
-        data = fetch_from_github(filename)
+        data = get_cached_file(filename)
 
         if data and data.get('historical_data'):
             return jsonify({
@@ -317,23 +2785,19 @@ def get_historical_data(region_code, timestamp):
             })
 
         # Если нет отдельного файла, ищем в общей истории
-        history_response = fetch_from_github(f"history_{region_code}.json")
+        history_response = get_cached_file(f"history_{region_code}.json")
         if history_response and history_response.get('history'):
             # Ищем запись с ближайшим timestamp
-            target_time = None
-            try:
-                target_time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            except:
-                pass
+            target_time = parse_history_time(timestamp)
+            if target_time is None:
+                # В URL время пишется через дефисы: 2024-01-01T10-00-00
+                date_part, _, time_part = url_timestamp.partition('T')
+                target_time = parse_history_time(f"{date_part}T{time_part.replace('-', ':')}")
 
             closest_item = None
-            closest_item_time = None
-            if target_time:
-                for item in history_response['history']:
-                    item_time = datetime.fromisoformat(item.get('full_timestamp', '2000-01-01').replace('Z', '+00:00'))
-                    if not closest_item or abs((item_time - target_time).total_seconds()) < abs((closest_item_time - target_time).total_seconds()):
-                        closest_item = item
-                        closest_item_time = item_time
+            if target_time is not None:
+                index = get_history_index(('file', region_code), history_response['history'])
+                closest_item = history_closest(index, target_time)
 
             if closest_item:
                 return jsonify({
@@ -346,7 +2810,7 @@ def get_historical_data(region_code, timestamp):
         # Ищем в кэше
         cached_data = get_cached_data()
         if cached_data and region_code in cached_data:
-            history = cached_data[region_code].get('history', [])
+            history = get_aggregate_history_index(region_code, cached_data[region_code])['history']
 
             # Ищем по timestamp
             for item in history:
@@ -374,6 +2838,7 @@ def get_historical_data(region_code, timestamp):
         }), 500
 
 @app.route('/api/auth/login', methods=['POST'])
+@rate_limit('login')
 def auth_login():
     """Аутентификация через LDAP или фолбэк"""
     try:
@@ -403,6 +2868,7 @@ def auth_login():
                     'auth_flow': 'ldap_direct',
                     'timestamp': datetime.now().isoformat()
                 })
+                response_data.update(issue_session_token(username, 'ldap_direct'))
                 return jsonify(response_data)
             
             # Если LDAP не сработал, но режим mixed - пробуем фолбэк
@@ -418,6 +2884,7 @@ def auth_login():
                         'ldap_error': ldap_result.get('error'),
                         'timestamp': datetime.now().isoformat()
                     })
+                    fallback_result.update(issue_session_token(username, 'fallback_after_ldap'))
                     print(f"✅ Fallback auth successful: {username}")
                     return jsonify(fallback_result)
                 
@@ -448,6 +2915,7 @@ def auth_login():
                     'auth_flow': 'fallback_only',
                     'timestamp': datetime.now().isoformat()
                 })
+                fallback_result.update(issue_session_token(username, 'fallback_only'))
                 print(f"✅ Fallback-only auth successful: {username}")
                 return jsonify(fallback_result)
             
@@ -489,25 +2957,26 @@ def test_ldap_connection():
         'url': LDAP_SERVER_URL or 'не указан'
     }
     
-    # Тест 2: Пинг LDAP сервера (если настроен)
+    # Тест 2: Пинг LDAP сервера (если настроен) - последний результат фоновой проверки
     if LDAP_SERVER_URL:
-        try:
-            # Пробуем получить health status от LDAP сервера
-            health_url = LDAP_SERVER_URL.replace('/api/ldap/auth', '/health')
-            
-            response = requests.get(health_url, timeout=5, verify=False)
-            
-            test_results['tests']['ldap_health'] = {
-                'passed': response.status_code == 200,
-                'message': 'LDAP сервер доступен' if response.status_code == 200 else f'LDAP сервер недоступен: {response.status_code}',
-                'status_code': response.status_code,
-                'response_time': response.elapsed.total_seconds() if hasattr(response, 'elapsed') else None
-            }
-        except Exception as e:
-            test_results['tests']['ldap_health'] = {
-                'passed': False,
-                'message': f'Ошибка подключения: {str(e)}'
-            }
+        probe = get_probe_result('ldap')
+        if probe.get('error'):
+            message = f"Ошибка подключения: {probe['error']}"
+        elif probe['status'] == 'available':
+            message = 'LDAP сервер доступен'
+        elif probe['status'] == 'unknown':
+            message = 'Проверка LDAP сервера еще не завершена'
+        else:
+            message = f"LDAP сервер недоступен: {probe.get('status_code')}"
+
+        test_results['tests']['ldap_health'] = {
+            'passed': probe['status'] == 'available',
+            'message': message,
+            'status_code': probe.get('status_code'),
+            'response_time': probe.get('latency'),
+            'checked_at': probe.get('checked_at'),
+            'age_seconds': probe['age_seconds']
+        }
     
     # Тест 3: Проверка фолбэк пользователей
     test_results['tests']['fallback_users'] = {
@@ -520,9 +2989,9 @@ def test_ldap_connection():
     passed_tests = [t for t in test_results['tests'].values() if t.get('passed', False)]
     if AUTH_MODE == 'fallback_only' and test_results['tests']['fallback_users']['passed']:
         test_results['overall'] = 'PASSED'
-    elif AUTH_MODE == 'ldap_only' and test_results['tests']['ldap_health']['passed']:
+    elif AUTH_MODE == 'ldap_only' and test_results['tests'].get('ldap_health', {}).get('passed'):
         test_results['overall'] = 'PASSED'
-    elif AUTH_MODE == 'mixed' and (test_results['tests']['ldap_health']['passed'] or test_results['tests']['fallback_users']['passed']):
+    elif AUTH_MODE == 'mixed' and (test_results['tests'].get('ldap_health', {}).get('passed') or test_results['tests']['fallback_users']['passed']):
         test_results['overall'] = 'PASSED'
     else:
         test_results['overall'] = 'FAILED'
@@ -533,20 +3002,12 @@ def test_ldap_connection():
 def auth_health():
     """Проверка доступности авторизации"""
     ldap_status = 'unknown'
-    
+    ldap_probe = None
+
     if LDAP_SERVER_URL:
-        try:
-            response = requests.get(
-                LDAP_SERVER_URL.replace('/api/ldap/auth', '/health'),
-                timeout=3,
-                verify=False
-            )
-            if response.status_code == 200:
-                ldap_status = 'available'
-            else:
-                ldap_status = 'unavailable'
-        except:
-            ldap_status = 'unavailable'
+        # Последний результат фоновой проверки вместо запроса на каждый вызов
+        ldap_probe = get_probe_result('ldap')
+        ldap_status = ldap_probe['status']
 
     return jsonify({
         'success': True,
@@ -554,6 +3015,8 @@ def auth_health():
             'mode': AUTH_MODE,
             'ldap_configured': bool(LDAP_SERVER_URL),
             'ldap_status': ldap_status,
+            'ldap_probe': ldap_probe,
+            'ldap_breaker': get_ldap_breaker_status(),
             'fallback_users': len(FALLBACK_USERS),
             'fallback_available': AUTH_MODE in ['mixed', 'fallback_only']
         },
@@ -565,11 +3028,14 @@ def auth_health():
     })
 
 @app.route('/api/region/<region_code>/refresh', methods=['POST'])
+@token_auth
+@rate_limit('refresh')
 def refresh_region_data(region_code):
     """Принудительное обновление данных региона"""
     try:
-        data = fetch_from_github(f"region_{region_code}.json")
+        data = get_cached_file(f"region_{region_code}.json", force=True)
         if data:
+            data = dict(data)
             data['forced_refresh'] = True
             data['refresh_timestamp'] = datetime.now().isoformat()
             return jsonify(data)
@@ -599,32 +3065,58 @@ def refresh_region_data(region_code):
         }), 500
 
 @app.route('/api/regions', methods=['GET'])
+@token_auth
+@rate_limit('regions')
 def get_all_regions():
-    """Получение списка всех регионов"""
+    """Получение списка всех регионов
+
+    Параметры: sort (поле), order (asc/desc), min_power_problems,
+    max_base_layer_percentage, limit, worst=K (K худших по базовому слою)
+    """
     try:
+        try:
+            sort = request.args.get('sort') or None
+            if sort is not None and sort not in REGION_SORT_FIELDS:
+                raise ValueError(f"sort - одно из полей {', '.join(REGION_SORT_FIELDS)}")
+            order = request.args.get('order', 'asc').lower()
+            if order not in ('asc', 'desc'):
+                raise ValueError('order - asc или desc')
+            worst = request.args.get('worst')
+            worst = max(int(worst), 0) if worst else None
+            limit = request.args.get('limit')
+            limit = max(int(limit), 0) if limit else None
+            min_power_problems = request.args.get('min_power_problems')
+            min_power_problems = float(min_power_problems) if min_power_problems else None
+            max_base_layer_percentage = request.args.get('max_base_layer_percentage')
+            max_base_layer_percentage = float(max_base_layer_percentage) if max_base_layer_percentage else None
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f'Некорректные параметры: {e}'
+            }), 400
+        descending = order == 'desc'
+
         cached_data = get_cached_data()
         if cached_data and '_meta' in cached_data:
-            regions_list = []
-            for region_code, data in cached_data.items():
-                if region_code != '_meta':
-                    current = data.get('current', {})
-                    stats = current.get('stats', {})
-                    regions_list.append({
-                        'code': region_code,
-                        'name': current.get('region_name', region_code),
-                        'total_bs': stats.get('total_bs', 0),
-                        'base_layer_percentage': stats.get('base_layer_percentage', 0),
-                        'power_problems': stats.get('power_problems', 0),
-                        'last_updated': current.get('timestamp', '00:00:00'),
-                        'has_history': len(data.get('history', [])) > 0
-                    })
+            def build_response():
+                summary = get_region_summary(cached_data)
+                regions_list = select_regions(
+                    summary, sort, descending, worst,
+                    min_power_problems, max_base_layer_percentage, limit
+                )
 
-            return jsonify({
-                'success': True,
-                'regions': regions_list,
-                'count': len(regions_list),
-                'timestamp': datetime.now().isoformat()
-            })
+                return jsonify({
+                    'success': True,
+                    'regions': regions_list,
+                    'count': len(regions_list),
+                    'total': len(summary['regions']),
+                    'timestamp': datetime.now().isoformat()
+                })
+
+            return versioned_response(
+                get_cached_data_version(cached_data), build_response,
+                sort, descending, worst, limit, min_power_problems, max_base_layer_percentage
+            )
 
         return jsonify({
             'success': True,
@@ -639,6 +3131,144 @@ def get_all_regions():
             'error': str(e)
         }), 500
 
+@app.route('/api/bs/search', methods=['GET'])
+@token_auth
+@rate_limit('bs')
+def search_base_stations():
+    """Поиск BS по префиксу id среди текущих данных всех регионов"""
+    prefix = request.args.get('prefix', '').strip()
+    try:
+        limit = int(request.args.get('limit', BS_SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Параметр limit должен быть числом'
+        }), 400
+    if not prefix:
+        return jsonify({
+            'success': False,
+            'error': 'Укажите параметр prefix'
+        }), 400
+    limit = min(max(limit, 1), BS_SEARCH_MAX_LIMIT)
+
+    cached_data = get_cached_data() or {}
+
+    def build_response():
+        index = get_bs_index(cached_data)
+        ids, has_more = search_bs_prefix(index, prefix, limit)
+        results = []
+        for bs_id in ids:
+            records = index['by_id'][bs_id]
+            results.append({
+                'bs_id': records[0]['bs_id'],
+                'regions': sorted({record['region_code'] for record in records}),
+                'technologies': sorted({record['technology'] for record in records}),
+                'count': len(records)
+            })
+        return jsonify({
+            'success': True,
+            'prefix': prefix,
+            'results': results,
+            'count': len(results),
+            'has_more': has_more,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    return versioned_response(get_cached_data_version(cached_data), build_response,
+                              normalize_bs_id(prefix), limit)
+
+@app.route('/api/bs/<bs_id>', methods=['GET'])
+@token_auth
+@rate_limit('bs')
+def get_base_station(bs_id):
+    """Где недоступна BS: записи из текущих данных всех регионов"""
+    cached_data = get_cached_data() or {}
+    records = get_bs_index(cached_data)['by_id'].get(normalize_bs_id(bs_id))
+    if not records:
+        return jsonify({
+            'success': False,
+            'error': f'BS {bs_id} не найдена в текущих данных',
+            'bs_id': bs_id
+        }), 404
+
+    def build_response():
+        return jsonify({
+            'success': True,
+            'bs_id': records[0]['bs_id'],
+            'records': records,
+            'count': len(records),
+            'timestamp': datetime.now().isoformat()
+        })
+
+    return versioned_response(get_cached_data_version(cached_data), build_response, normalize_bs_id(bs_id))
+
+@app.route('/api/stream', methods=['GET'])
+@token_auth(allow_query_token=True)
+@rate_limit('stream')
+def stream_regions():
+    """Server-Sent Events: текущее состояние регионов, затем только их изменения
+
+    ?regions=77,50 - подписка на часть регионов (по умолчанию все).
+    Без событий раз в SSE_HEARTBEAT_INTERVAL отправляется комментарий-пинг.
+    """
+    if SSE_MAX_SUBSCRIBERS <= 0:
+        return jsonify({
+            'success': False,
+            'error': 'Поток обновлений выключен (нужен ASYNC_MODE=gevent или SSE_MAX_SUBSCRIBERS)',
+            'error_code': 'STREAM_DISABLED'
+        }), 503
+
+    region_codes = {code.strip() for code in request.args.get('regions', '').split(',') if code.strip()}
+    subscriber = subscribe_stream(region_codes or None)
+    if subscriber is None:
+        response = jsonify({
+            'success': False,
+            'error': 'Слишком много открытых потоков, повторите позже',
+            'error_code': 'STREAM_LIMIT'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SSE_RETRY_MS // 1000)
+        return response
+
+    def generate():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            cached_data = get_cached_data() or {}
+            sent = {}
+            for region_code, region in cached_data.items():
+                if region_code == '_meta' or not isinstance(region, dict):
+                    continue
+                if subscriber['regions'] is None or region_code in subscriber['regions']:
+                    sent[region_code] = region_event(region_code, region.get('current') or {})
+                    yield format_sse('region', sent[region_code])
+            # Подписчик зарегистрирован до снимка: обновление кэша (в том числе
+            # вызванное get_cached_data выше) уже лежит в pending. Повторы снимка
+            # отбрасываем, более новые состояния отправляем
+            for event in take_stream_events(subscriber):
+                if sent.get(event['code']) != event:
+                    yield format_sse('region', event)
+
+            deadline = time.monotonic() + SSE_MAX_DURATION
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                if not subscriber['wakeup'].wait(min(SSE_HEARTBEAT_INTERVAL, remaining)):
+                    # Без прогрева кэш обновляется запросами - поток тоже его обновляет
+                    get_cached_data()
+                    yield ': ping\n\n'
+                    continue
+                for event in take_stream_events(subscriber):
+                    yield format_sse('region', event)
+        finally:
+            unsubscribe_stream(subscriber)
+
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check для мониторинга"""
@@ -647,6 +3277,18 @@ def health_check():
         'timestamp': datetime.now().isoformat(),
         'service': 'dostupnost-api',
         'features': ['current_data', 'historical_data', 'full_history', 'ldap_auth'],
+        'cache': {
+            'aggregate': get_cached_data_status(),
+            'files': get_file_cache_stats(),
+            'shared': dict(shared_cache_stats, enabled=bool(SHARED_CACHE_DIR)),
+            'responses': get_response_cache_stats(),
+            'text_pool': get_text_pool_stats(),
+            'warmer': get_warmer_status()
+        },
+        'stream': get_stream_status(),
+        'upstream': {
+            'github': get_probe_result('github')
+        },
         'auth': {
             'mode': AUTH_MODE,
             'ldap_configured': bool(LDAP_SERVER_URL),
@@ -654,6 +3296,30 @@ def health_check():
         }
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Метрики процесса в формате Prometheus"""
+    samples = []
+
+    files = get_file_cache_stats()
+    responses = get_response_cache_stats()
+    for cache_name, stats in (('files', files), ('responses', responses)):
+        for event, field in (('hit', 'hits'), ('miss', 'misses'), ('eviction', 'evictions')):
+            samples.append(('dostupnost_cache_events_total',
+                            (('cache', cache_name), ('event', event)), stats[field]))
+        samples.append(('dostupnost_cache_entries', (('cache', cache_name),), stats['entries']))
+        samples.append(('dostupnost_cache_bytes', (('cache', cache_name),), stats['bytes']))
+    samples.append(('dostupnost_cache_events_total',
+                    (('cache', 'files'), ('event', 'negative_hit')), files['negative_hits']))
+    samples.append(('dostupnost_cache_entries', (('cache', 'missing_files'),), files['negative_entries']))
+
+    aggregate = get_cached_data_status()
+    if aggregate['age_seconds'] is not None:
+        samples.append(('dostupnost_cache_age_seconds', (('cache', 'cached_data'),), aggregate['age_seconds']))
+    samples.append(('dostupnost_stream_subscribers', (), get_stream_status()['subscribers']))
+
+    return app.response_class(render_metrics(samples), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def home():
     """Домашняя страница API"""
@@ -691,6 +3357,8 @@ def home():
                 <li><code>GET /api/region/{code}</code> - Данные региона</li>
                 <li><code>GET /api/region/{code}/history</code> - История региона</li>
                 <li><code>GET /api/regions</code> - Список регионов</li>
+                <li><code>GET /api/bs/{id}</code> - Где недоступна базовая станция</li>
+                <li><code>GET /api/bs/search?prefix=</code> - Поиск BS по префиксу</li>
                 <li><code>GET /api/auth/ldap/test</code> - Тест LDAP</li>
                 <li><code>GET /api/health</code> - Проверка здоровья</li>
             </ul>
@@ -715,6 +3383,9 @@ def home():
         GITHUB_REPO
     )
 
+if CACHE_WARMER_ENABLED:
+    start_cache_warmer()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     
@@ -726,12 +3397,18 @@ if __name__ == '__main__':
     print(f"   • LDAP сервер: {LDAP_SERVER_URL or 'Не настроен'}")
     print(f"   • GitHub репозиторий: {GITHUB_REPO}")
     print(f"   • Фолбэк пользователей: {len(FALLBACK_USERS)}")
+    print(f"   • Режим ввода-вывода: {ASYNC_MODE or 'sync'}")
+    print(f"   • Доверенных прокси (X-Forwarded-For): {TRUSTED_PROXY_COUNT}")
     
     print(f"\n📋 ДОСТУПНЫЕ ENDPOINTS:")
     print(f"   • POST /api/auth/login")
     print(f"   • GET  /api/region/{{code}}")
     print(f"   • GET  /api/region/{{code}}/history")
-    print(f"   • GET  /api/regions")
+    print(f"   • GET  /api/region/{{code}}/history/rollup?hours=&bucket=")
+    print(f"   • GET  /api/regions?sort=&order=&worst=&limit=")
+    print(f"   • GET  /api/regions/batch?codes=...")
+    print(f"   • GET  /api/stream?regions=... (Server-Sent Events)")
+    print(f"   • GET  /api/bs/{{id}}, /api/bs/search?prefix=")
     print(f"   • GET  /api/auth/health")
     
     print(f"\n🔧 НАСТРОЙКА LDAP:")
@@ -739,4 +3416,8 @@ if __name__ == '__main__':
     print(f"   2. Формат: https://ваш_ip:8443/api/ldap/auth")
     print(f"   3. Для теста используйте: admin/admin")
     
-    app.run(host='0.0.0.0', port=port, debug=False)
+    if ASYNC_MODE == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('0.0.0.0', port), app, log=AccessTokenLog(sys.stderr)).serve_forever()
+    else:
+        app.run(host='0.0.0.0', port=port, debug=False)
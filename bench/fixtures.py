@@ -0,0 +1,103 @@
+"""
+ГЕНЕРАТОР ТЕСТОВЫХ ДАННЫХ ДЛЯ НАГРУЗОЧНЫХ ТЕСТОВ
+Создает cached_data.json, region_*.json и history_*.json в формате GitHub репозитория
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+TECHNOLOGIES = ['GSM900', 'UMTS2100', 'LTE800', 'LTE1800', 'LTE2600']
+
+
+def region_codes(count):
+    """Коды регионов: 01, 02, ... (как в боевых данных)"""
+    return [f"{i:02d}" for i in range(1, count + 1)]
+
+
+def make_texts(rng, region_code, total_bs, down_count):
+    """Тексты base_layer и non_priority с перечислением недоступных BS"""
+    base_lines = [f"{region_code} Базовый слой", "", f"Всего BS: {total_bs}",
+                  f"Базовый слой: {total_bs - down_count}/{total_bs}", ""]
+    priority_lines = [f"{region_code} Технологии", ""]
+    for technology in rng.sample(TECHNOLOGIES, 2):
+        base_lines.append(f"Недоступно {technology}:")
+        priority_lines.append(f"Недоступно {technology}:")
+        for n in range(1, down_count // 2 + 2):
+            bs_id = f"BS{region_code}{rng.randint(0, 999):03d}"
+            base_lines.append(f"{n}) {bs_id}")
+            priority_lines.append(f"{n}) {bs_id}")
+        base_lines.append("")
+        priority_lines.append("")
+    return '\n'.join(base_lines), '\n'.join(priority_lines)
+
+
+def make_snapshot(rng, region_code, moment, texts=None):
+    """Одна запись истории (снимок региона)"""
+    total_bs = rng.randint(80, 400)
+    down_count = rng.randint(0, 12)
+    base_layer, non_priority = texts or make_texts(rng, region_code, total_bs, down_count)
+    return {
+        'full_timestamp': moment.isoformat(timespec='seconds'),
+        'timestamp': moment.strftime('%H:%M:%S'),
+        'base_layer': base_layer,
+        'non_priority': non_priority,
+        'stats': {
+            'total_bs': total_bs,
+            'base_layer_count': total_bs - down_count,
+            'base_layer_percentage': round((total_bs - down_count) * 100 / total_bs, 2),
+            'power_problems': rng.randint(0, 5),
+            'non_priority_percentage': round(rng.uniform(0, 15), 2)
+        }
+    }
+
+
+def generate(directory, regions=80, history=288, step_minutes=5, seed=1, missing_region_files=0.1):
+    """Пишет набор файлов в directory и возвращает список кодов регионов
+
+    missing_region_files - доля регионов без отдельного region_*.json
+    (такие запросы идут по пути фолбэка на общий кэш).
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.now().replace(microsecond=0)
+    codes = region_codes(regions)
+
+    aggregate = {'_meta': {'updated': now.isoformat(), 'regions': regions}}
+    for code in codes:
+        snapshots = []
+        texts = None
+        for i in range(history):
+            moment = now - timedelta(minutes=step_minutes * (history - 1 - i))
+            # Текст меняется редко - как в боевых данных, где подряд идут одинаковые снимки
+            if texts is None or rng.random() < 0.1:
+                texts = make_texts(rng, code, 100, rng.randint(0, 12))
+            snapshots.append(make_snapshot(rng, code, moment, texts))
+
+        current = dict(snapshots[-1], success=True, region_code=code, region_name=f"Регион {code}")
+        aggregate[code] = {'current': current, 'history': snapshots}
+
+        if rng.random() >= missing_region_files:
+            with open(os.path.join(directory, f"region_{code}.json"), 'w', encoding='utf-8') as f:
+                json.dump(current, f, ensure_ascii=False)
+        with open(os.path.join(directory, f"history_{code}.json"), 'w', encoding='utf-8') as f:
+            json.dump({'success': True, 'region_code': code, 'history': snapshots,
+                       'count': len(snapshots)}, f, ensure_ascii=False)
+
+    with open(os.path.join(directory, 'cached_data.json'), 'w', encoding='utf-8') as f:
+        json.dump(aggregate, f, ensure_ascii=False)
+    return codes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Генерация тестовых данных для нагрузочных тестов')
+    parser.add_argument('directory')
+    parser.add_argument('--regions', type=int, default=80)
+    parser.add_argument('--history', type=int, default=288, help='записей истории на регион')
+    parser.add_argument('--step-minutes', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    generated = generate(args.directory, args.regions, args.history, args.step_minutes, args.seed)
+    print(f"✅ Сгенерировано регионов: {len(generated)} в {args.directory}")
@@ -0,0 +1,151 @@
+"""
+НАГРУЗОЧНЫЙ ДРАЙВЕР ДЛЯ API СЕРВЕРА
+Гоняет смесь запросов по всем маршрутам и печатает пропускную способность
+и p50/p95/p99 по каждому маршруту
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import requests
+
+
+def build_scenarios(region_codes, with_auth=True):
+    """Маршруты нагрузки: (имя, вес, функция, строящая (метод, путь, json))"""
+    def region():
+        return random.choice(region_codes)
+
+    def snapshot_time():
+        moment = datetime.now() - timedelta(minutes=random.randint(0, 600))
+        return moment.strftime('%Y-%m-%dT%H-%M-%S')
+
+    scenarios = [
+        ('GET /api/region/<code>', 30, lambda: ('GET', f"/api/region/{region()}", None)),
+        ('GET /api/region/<code>/history', 10, lambda: ('GET', f"/api/region/{region()}/history", None)),
+        ('GET /api/region/<code>/history?hours=6', 10,
+         lambda: ('GET', f"/api/region/{region()}/history?hours=6", None)),
+        ('GET /api/region/<code>/history?limit&fields', 5,
+         lambda: ('GET', f"/api/region/{region()}/history?limit=100&fields=full_timestamp,stats", None)),
+        ('GET /api/region/<code>/history/rollup', 10,
+         lambda: ('GET', f"/api/region/{region()}/history/rollup?hours=24", None)),
+        ('GET /api/region/<code>/history/<timestamp>', 5,
+         lambda: ('GET', f"/api/region/{region()}/history/{snapshot_time()}", None)),
+        ('GET /api/regions', 10, lambda: ('GET', '/api/regions', None)),
+        ('GET /api/regions/batch', 5,
+         lambda: ('GET', f"/api/regions/batch?codes={','.join(random.sample(region_codes, min(20, len(region_codes))))}", None)),
+        ('POST /api/region/<code>/refresh', 2, lambda: ('POST', f"/api/region/{region()}/refresh", None)),
+        ('GET /api/bs/search', 3, lambda: ('GET', f"/api/bs/search?prefix=BS{region()}", None)),
+        ('GET /api/bs/<id>', 3, lambda: ('GET', f"/api/bs/BS{region()}{random.randint(0, 999):03d}", None)),
+        ('GET /api/health', 3, lambda: ('GET', '/api/health', None)),
+        ('GET /api/auth/health', 2, lambda: ('GET', '/api/auth/health', None)),
+        ('GET /api/metrics', 1, lambda: ('GET', '/api/metrics', None)),
+    ]
+    if with_auth:
+        scenarios.append(('POST /api/auth/login', 2, lambda: (
+            'POST', '/api/auth/login', {'username': 'operator', 'password': 'operator123'}
+        )))
+    return scenarios
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def run_load(base_url, region_codes, concurrency=16, duration=30.0, warmup=2.0, timeout=15.0, with_auth=True):
+    """Запускает нагрузку и возвращает отчет {маршрут: статистика}"""
+    scenarios = build_scenarios(region_codes, with_auth)
+    names = [name for name, _, _ in scenarios]
+    weights = [weight for _, weight, _ in scenarios]
+    builders = {name: builder for name, _, builder in scenarios}
+
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    lock = threading.Lock()
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def worker():
+        session = requests.Session()
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                return
+            name = random.choices(names, weights)[0]
+            method, path, payload = builders[name]()
+            request_started = time.perf_counter()
+            try:
+                response = session.request(method, base_url + path, json=payload, timeout=timeout)
+                status = response.status_code
+            except requests.RequestException:
+                status = 'error'
+            elapsed = time.perf_counter() - request_started
+            if now >= measure_from:
+                with lock:
+                    latencies[name].append(elapsed)
+                    statuses[name][status] += 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    report = {}
+    for name in names:
+        values = sorted(latencies[name])
+        if not values:
+            continue
+        report[name] = {
+            'requests': len(values),
+            'rps': round(len(values) / duration, 1),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2),
+            'statuses': {str(key): value for key, value in statuses[name].items()}
+        }
+    total = sum(item['requests'] for item in report.values())
+    report['_total'] = {'requests': total, 'rps': round(total / duration, 1),
+                        'concurrency': concurrency, 'duration': duration}
+    return report
+
+
+def print_report(report):
+    """Таблица результатов"""
+    print(f"\n{'маршрут':<48} {'запр.':>7} {'rps':>8} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9}  статусы")
+    for name, item in report.items():
+        if name.startswith('_'):
+            continue
+        statuses = ', '.join(f"{key}:{value}" for key, value in sorted(item['statuses'].items()))
+        print(f"{name:<48} {item['requests']:>7} {item['rps']:>8} {item['p50_ms']:>9} "
+              f"{item['p95_ms']:>9} {item['p99_ms']:>9}  {statuses}")
+    total = report['_total']
+    print(f"\nВсего: {total['requests']} запросов, {total['rps']} rps "
+          f"({total['concurrency']} потоков, {total['duration']:g}с)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузка на работающий API сервер')
+    parser.add_argument('base_url', help='например http://127.0.0.1:5000')
+    parser.add_argument('--regions', type=int, default=80, help='сколько кодов регионов (01..NN) опрашивать')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--json', dest='json_path', help='сохранить отчет в JSON')
+    args = parser.parse_args()
+
+    codes = [f"{i:02d}" for i in range(1, args.regions + 1)]
+    result = run_load(args.base_url.rstrip('/'), codes, args.concurrency, args.duration, args.warmup)
+    print_report(result)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,144 @@
+"""
+ВОСПРОИЗВОДИМЫЙ БЕНЧМАРК
+1. генерирует тестовые данные во временный каталог
+2. поднимает заглушку GitHub/LDAP с заданной задержкой
+3. запускает api_server.py (gunicorn, если установлен, иначе встроенный сервер)
+4. гоняет нагрузку и печатает p50/p95/p99 по маршрутам
+
+Пример:
+    python bench/run.py --duration 30 --concurrency 32 --github-latency 0.05 --json before.json
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fixtures import generate  # noqa: E402
+from load import print_report, run_load  # noqa: E402
+from upstream_stub import StubConfig, start_stub  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, stub_url, server_mode, workers, extra_env):
+    """Запускает API сервер отдельным процессом"""
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'GITHUB_RAW_BASE': stub_url + '/',
+        'LDAP_SERVER_URL': stub_url + '/api/ldap/auth',
+        # Лимиты запросов отключены: нагрузка идет с одного адреса
+        'RATE_LIMITS': '',
+        'PYTHONUNBUFFERED': '1'
+    })
+    env.update(extra_env)
+
+    if server_mode == 'auto':
+        server_mode = 'gunicorn' if shutil.which('gunicorn') else 'flask'
+
+    if server_mode == 'gunicorn':
+        command = ['gunicorn', '-c', os.path.join(ROOT_DIR, 'gunicorn.conf.py'),
+                   '-b', f'127.0.0.1:{port}', '-w', str(workers), 'api_server:app']
+    else:
+        command = [sys.executable, os.path.join(ROOT_DIR, 'api_server.py')]
+
+    log = open(os.path.join(tempfile.gettempdir(), f'bench_server_{port}.log'), 'w')
+    process = subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, server_mode, log.name
+
+
+def wait_ready(base_url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            if requests.get(base_url + '/api/test', timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def parse_env(pairs):
+    env = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        env[key] = value
+    return env
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк API сервера на локальной заглушке')
+    parser.add_argument('--regions', type=int, default=80)
+    parser.add_argument('--history', type=int, default=288, help='записей истории на регион')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--github-latency', type=float, default=0.05, help='задержка GitHub, с')
+    parser.add_argument('--ldap-latency', type=float, default=0.1, help='задержка LDAP, с')
+    parser.add_argument('--ldap-failure-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'flask'], default='auto')
+    parser.add_argument('--workers', type=int, default=2, help='воркеры gunicorn')
+    parser.add_argument('--env', action='append', metavar='KEY=VALUE',
+                        help='доп. переменные окружения сервера (можно несколько раз)')
+    parser.add_argument('--no-auth', action='store_true', help='не включать логин в смесь запросов')
+    parser.add_argument('--json', dest='json_path', help='сохранить отчет в JSON')
+    args = parser.parse_args()
+
+    fixtures_dir = tempfile.mkdtemp(prefix='dostupnost_bench_')
+    codes = generate(fixtures_dir, args.regions, args.history, seed=args.seed)
+    print(f"📦 Данные: {len(codes)} регионов x {args.history} записей в {fixtures_dir}")
+
+    stub_config = StubConfig(fixtures_dir, args.github_latency, args.ldap_latency, args.ldap_failure_rate)
+    stub_server, stub_url = start_stub(stub_config)
+    print(f"🧪 Заглушка: {stub_url} (GitHub {args.github_latency * 1000:g} мс, LDAP {args.ldap_latency * 1000:g} мс)")
+
+    port = free_port()
+    server, mode, log_path = start_server(port, stub_url, args.server, args.workers, parse_env(args.env))
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        if not wait_ready(base_url, server):
+            print(f"❌ Сервер не запустился, лог: {log_path}")
+            sys.exit(1)
+        print(f"🚀 Сервер ({mode}): {base_url}, лог: {log_path}")
+        print(f"⏱️  Нагрузка: {args.concurrency} потоков, {args.duration:g}с (+{args.warmup:g}с прогрев)")
+
+        report = run_load(base_url, codes, args.concurrency, args.duration, args.warmup,
+                          with_auth=not args.no_auth)
+        report['_total']['upstream_requests'] = stub_config.requests
+        report['_config'] = {key: value for key, value in vars(args).items() if key != 'json_path'}
+        report['_config']['server'] = mode
+        print_report(report)
+        print(f"Запросов к заглушке: {stub_config.requests}")
+
+        if args.json_path:
+            with open(args.json_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"💾 Отчет: {args.json_path}")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        stub_server.shutdown()
+        shutil.rmtree(fixtures_dir, ignore_errors=True)
@@ -0,0 +1,152 @@
+"""
+ЛОКАЛЬНАЯ ЗАМЕНА raw.githubusercontent.com И LDAP ШЛЮЗА ДЛЯ НАГРУЗОЧНЫХ ТЕСТОВ
+GET/HEAD /<файл> - файлы из каталога с ETag и 304 на If-None-Match
+POST /api/ldap/auth, GET /health - LDAP шлюз с настраиваемой задержкой и долей отказов
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+    """Настройки заглушки (меняются на лету из тестов)"""
+
+    def __init__(self, fixtures_dir, github_latency=0.0, ldap_latency=0.0, ldap_failure_rate=0.0):
+        self.fixtures_dir = fixtures_dir
+        self.github_latency = github_latency
+        self.ldap_latency = ldap_latency
+        self.ldap_failure_rate = ldap_failure_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+        # Кэш файлов: имя -> (mtime, тело, etag)
+        self.files = {}
+
+    def load_file(self, name):
+        path = os.path.join(self.fixtures_dir, name)
+        if os.path.dirname(os.path.normpath(name)) or not os.path.isfile(path):
+            return None
+        mtime = os.stat(path).st_mtime
+        with self.lock:
+            cached = self.files.get(name)
+            if cached and cached[0] == mtime:
+                return cached
+        with open(path, 'rb') as f:
+            body = f.read()
+        entry = (mtime, body, '"%s"' % hashlib.md5(body).hexdigest())
+        with self.lock:
+            self.files[name] = entry
+        return entry
+
+
+def make_handler(config):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=b'', headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if body and self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def _count(self):
+            with config.lock:
+                config.requests += 1
+
+        def do_HEAD(self):
+            self.do_GET()
+
+        def do_GET(self):
+            self._count()
+            path = self.path.split('?')[0].lstrip('/')
+
+            if path == 'health':
+                time.sleep(config.ldap_latency)
+                self._send(200, b'{"status": "ok"}', {'Content-Type': 'application/json'})
+                return
+
+            time.sleep(config.github_latency)
+            entry = config.load_file(path)
+            if entry is None:
+                self._send(404, b'404: Not Found')
+                return
+
+            _, body, etag = entry
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, headers={'ETag': etag})
+                return
+            self._send(200, body, {'ETag': etag, 'Content-Type': 'text/plain; charset=utf-8'})
+
+        def do_POST(self):
+            self._count()
+            length = int(self.headers.get('Content-Length', 0))
+            payload = self.rfile.read(length)
+
+            if self.path.split('?')[0] != '/api/ldap/auth':
+                self._send(404)
+                return
+
+            time.sleep(config.ldap_latency)
+            if random.random() < config.ldap_failure_rate:
+                self._send(503, b'{"success": false, "error": "LDAP unavailable"}',
+                           {'Content-Type': 'application/json'})
+                return
+
+            try:
+                credentials = json.loads(payload)
+            except ValueError:
+                credentials = {}
+            username = credentials.get('username', '')
+            if credentials.get('password') == 'wrong':
+                self._send(401, b'{"success": false, "error": "invalid credentials"}',
+                           {'Content-Type': 'application/json'})
+                return
+
+            body = json.dumps({
+                'success': True,
+                'username': username,
+                'display_name': username,
+                'email': f'{username}@t2.ru',
+                'auth_source': 'ldap_stub'
+            }).encode('utf-8')
+            self._send(200, body, {'Content-Type': 'application/json'})
+
+    return StubHandler
+
+
+def start_stub(config, host='127.0.0.1', port=0):
+    """Запускает заглушку в фоновом потоке; возвращает (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='upstream-stub', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Заглушка GitHub raw и LDAP шлюза')
+    parser.add_argument('fixtures_dir')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--github-latency', type=float, default=0.05, help='задержка GitHub, с')
+    parser.add_argument('--ldap-latency', type=float, default=0.1, help='задержка LDAP, с')
+    parser.add_argument('--ldap-failure-rate', type=float, default=0.0, help='доля отказов LDAP (0..1)')
+    args = parser.parse_args()
+
+    stub_config = StubConfig(args.fixtures_dir, args.github_latency, args.ldap_latency, args.ldap_failure_rate)
+    stub_server, base_url = start_stub(stub_config, args.host, args.port)
+    print(f"🧪 Заглушка запущена: {base_url}/ (LDAP: {base_url}/api/ldap/auth)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub_server.shutdown()
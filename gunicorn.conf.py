@@ -0,0 +1,12 @@
+"""
+Конфигурация gunicorn (подхватывается автоматически из рабочего каталога)
+Параметры командной строки имеют приоритет над этим файлом.
+"""
+import os
+
+# ASYNC_MODE=gevent: кооперативные воркеры вместо синхронных. Медленный ответ
+# GitHub или LDAP больше не занимает воркер целиком - пока он ждет сеть,
+# тот же процесс обслуживает другие запросы.
+if os.environ.get('ASYNC_MODE', '').lower() == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('ASYNC_WORKER_CONNECTIONS', 1000))
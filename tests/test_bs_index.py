@@ -0,0 +1,127 @@
+"""
+Тесты индекса базовых станций: разбор текстов, дубликаты, поиск по префиксу
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server  # noqa: E402
+
+
+def make_region(name, base_layer=None, non_priority=None):
+    return {'current': {
+        'region_name': name,
+        'full_timestamp': '2024-05-01 12:00:00',
+        'base_layer': base_layer,
+        'non_priority': non_priority
+    }}
+
+
+def test_parse_sections_and_items():
+    text = 'Недоступно LTE1800:\n1) BS1001\n2. BS1002\n\nНедоступно GSM 900:\n1) bs2001 (Москва)\n'
+    assert api_server.parse_bs_text(text) == [
+        ('BS1001', 'LTE1800', 'Недоступно'),
+        ('BS1002', 'LTE1800', 'Недоступно'),
+        ('bs2001', 'GSM 900', 'Недоступно'),
+    ]
+
+
+@pytest.mark.parametrize('text', [None, '', '   \n\n', 'Все работает'])
+def test_parse_empty_or_without_sections(text):
+    assert api_server.parse_bs_text(text) == []
+
+
+def test_parse_skips_malformed_lines():
+    text = '\n'.join([
+        '1) BS0001',              # строка до первого заголовка
+        'Недоступно LTE1800:',
+        '1) BS1001',
+        'BS1002',                 # без номера
+        '2) BS1003',              # после нераспознанной строки раздел сброшен
+        'Недоступно:',            # заголовок без технологии
+        '1) BS1004',
+        '  Деградация  UMTS2100:  ',
+        '  7)   BS1005  ',
+        '8)',                     # номер без id
+    ])
+    assert api_server.parse_bs_text(text) == [
+        ('BS1001', 'LTE1800', 'Недоступно'),
+        ('BS1005', 'UMTS2100', 'Деградация'),
+    ]
+
+
+def test_parse_handles_crlf():
+    assert api_server.parse_bs_text('Недоступно LTE800:\r\n1) BS1\r\n') == [('BS1', 'LTE800', 'Недоступно')]
+
+
+def test_index_merges_duplicate_ids():
+    cached_data = {
+        '_meta': {'base_layer': 'Недоступно LTE1800:\n1) BS9999'},
+        '77': make_region('Москва', 'Недоступно LTE1800:\n1) BS1001\n2) BS1001',
+                          'Недоступно GSM900:\n1) bs1001'),
+        '50': make_region('Московская область', 'Недоступно LTE800:\n1) Bs1001'),
+        '99': 'не регион',
+        '10': {'current': None},
+    }
+    index = api_server.build_bs_index(cached_data)
+
+    assert index['source'] is cached_data
+    assert index['ids'] == ['BS1001']
+    records = index['by_id']['BS1001']
+    assert [(r['region_code'], r['source'], r['technology'], r['bs_id']) for r in records] == [
+        ('77', 'base_layer', 'LTE1800', 'BS1001'),
+        ('77', 'base_layer', 'LTE1800', 'BS1001'),
+        ('77', 'non_priority', 'GSM900', 'bs1001'),
+        ('50', 'base_layer', 'LTE800', 'Bs1001'),
+    ]
+    assert records[0]['region_name'] == 'Москва'
+    assert records[0]['timestamp'] == '2024-05-01 12:00:00'
+
+
+@pytest.fixture
+def index():
+    ids = ['BS20', 'BS1', 'BS100', 'BS10', 'AB1', 'BS11', 'BT1', 'BS2']
+    text = 'Недоступно LTE1800:\n' + '\n'.join(f'{i}) {bs_id}' for i, bs_id in enumerate(ids, 1))
+    return api_server.build_bs_index({'77': make_region('Москва', text)})
+
+
+def test_prefix_search_is_sorted(index):
+    assert api_server.search_bs_prefix(index, 'BS1', 10) == (['BS1', 'BS10', 'BS100', 'BS11'], False)
+    assert api_server.search_bs_prefix(index, 'bs', 10) == (
+        ['BS1', 'BS10', 'BS100', 'BS11', 'BS2', 'BS20'], False)
+
+
+def test_prefix_search_limit_and_has_more(index):
+    assert api_server.search_bs_prefix(index, 'BS', 3) == (['BS1', 'BS10', 'BS100'], True)
+    assert api_server.search_bs_prefix(index, 'BS1', 4) == (['BS1', 'BS10', 'BS100', 'BS11'], False)
+    assert api_server.search_bs_prefix(index, 'BS2', 1) == (['BS2'], True)
+
+
+def test_prefix_search_edges(index):
+    assert api_server.search_bs_prefix(index, 'BS100', 10) == (['BS100'], False)
+    assert api_server.search_bs_prefix(index, 'BS3', 10) == ([], False)
+    assert api_server.search_bs_prefix(index, 'ZZ', 10) == ([], False)
+    assert api_server.search_bs_prefix(index, 'A', 10) == (['AB1'], False)
+    assert api_server.search_bs_prefix(index, ' bt ', 10) == (['BT1'], False)
+
+
+def test_search_endpoint(monkeypatch):
+    cached_data = {
+        '77': make_region('Москва', 'Недоступно LTE1800:\n1) BS1001\n2) BS1002'),
+        '50': make_region('Московская область', 'Недоступно GSM900:\n1) bs1001'),
+    }
+    monkeypatch.setattr(api_server, 'get_cached_data', lambda: cached_data)
+    monkeypatch.setitem(api_server.RATE_LIMIT_RULES, 'bs', (1e9, 1e9))
+    client = api_server.app.test_client()
+
+    body = client.get('/api/bs/search?prefix=bs100&limit=1').get_json()
+    assert body['has_more'] is True
+    assert body['results'] == [{'bs_id': 'BS1001', 'regions': ['50', '77'],
+                                'technologies': ['GSM900', 'LTE1800'], 'count': 2}]
+
+    body = client.get('/api/bs/bs1002').get_json()
+    assert [record['region_code'] for record in body['records']] == ['77']
+    assert client.get('/api/bs/BS404').status_code == 404
@@ -0,0 +1,117 @@
+"""
+Тесты компактных записей истории (SnapshotRecord, пул строк, JSON провайдер)
+"""
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+import api_server  # noqa: E402
+from fixtures import generate  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def history_raw(tmp_path_factory):
+    """Настоящий файл истории из генератора бенчмарка"""
+    directory = tmp_path_factory.mktemp('fixtures')
+    codes = generate(str(directory), regions=2, history=60, seed=7)
+    with open(directory / f'history_{codes[0]}.json', 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def fresh_layouts(monkeypatch):
+    monkeypatch.setattr(api_server, 'snapshot_layouts', {})
+
+
+def test_records_are_compact_and_equal(history_raw, fresh_layouts):
+    plain = json.loads(history_raw)
+    compact = api_server.decode_history_json(history_raw)
+
+    assert type(compact) is dict
+    assert isinstance(compact['history'][0], api_server.SnapshotRecord)
+    assert compact == plain
+    assert [dict(item) for item in compact['history']] == plain['history']
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'ensure_ascii': False},
+    {'sort_keys': True},
+    {'ensure_ascii': False, 'separators': (',', ':'), 'sort_keys': True},
+])
+def test_json_dumps_is_byte_identical(history_raw, fresh_layouts, options):
+    plain = json.loads(history_raw)
+    compact = api_server.decode_history_json(history_raw)
+    assert (json.dumps(compact, default=api_server.json_default, **options)
+            == json.dumps(plain, **options))
+
+
+def test_flask_provider_is_byte_identical(history_raw, fresh_layouts):
+    plain = json.loads(history_raw)
+    compact = api_server.decode_history_json(history_raw)
+    with api_server.app.app_context():
+        assert api_server.app.json.dumps(compact) == api_server.app.json.dumps(plain)
+        assert (api_server.jsonify(compact).get_data()
+                == api_server.jsonify(plain).get_data())
+
+
+def test_history_endpoint_bytes_match_plain_dicts(history_raw, fresh_layouts, monkeypatch):
+    """Ответы /history одинаковы для компактных записей и обычных dict"""
+    monkeypatch.setitem(api_server.RATE_LIMIT_RULES, 'history', (1e9, 1e9))
+    client = api_server.app.test_client()
+    urls = ['/api/region/77/history', '/api/region/77/history?limit=7',
+            '/api/region/77/history?limit=5&fields=full_timestamp,stats']
+
+    def responses(data, version):
+        entry = {'data': data, 'version': version}
+        monkeypatch.setattr(api_server, 'get_cached_file_entry',
+                            lambda filename, **kwargs: entry if filename == 'history_77.json' else None)
+        bodies = []
+        for url in urls:
+            response = client.get(url, headers={'Accept-Encoding': 'identity'})
+            assert response.status_code == 200
+            bodies.append(response.get_data())
+        return bodies
+
+    compact = responses(api_server.decode_history_json(history_raw), 'compact-v1')
+    plain = responses(json.loads(history_raw), 'plain-v1')
+    assert compact == plain
+
+
+def test_long_strings_are_pooled(history_raw, fresh_layouts):
+    compact = api_server.decode_history_json(history_raw)
+    first, second = compact['history'][0], compact['history'][1]
+    long_keys = [key for key, value in first.items()
+                 if isinstance(value, str) and len(value) >= api_server.TEXT_POOL_MIN_LENGTH
+                 and value == second.get(key)]
+    assert long_keys
+    for key in long_keys:
+        assert first[key] is second[key]
+
+
+def test_layout_overflow_falls_back_to_dict(fresh_layouts, monkeypatch):
+    monkeypatch.setattr(api_server, 'SNAPSHOT_LAYOUTS_MAX', 2)
+    raw = json.dumps([{'a': 1}, {'b': 2}, {'c': 3}, {'a': 4}]).encode('utf-8')
+    records = api_server.decode_history_json(raw)
+
+    assert [type(item).__name__ for item in records] == ['SnapshotRecord', 'SnapshotRecord', 'dict', 'SnapshotRecord']
+    assert records == json.loads(raw)
+    assert json.dumps(records, default=api_server.json_default) == json.dumps(json.loads(raw))
+
+
+def test_record_mapping_behaviour(fresh_layouts):
+    record = api_server.decode_history_json(b'[{"x": 1, "y": [1, 2], "z": null}]')[0]
+    assert list(record) == ['x', 'y', 'z']
+    assert len(record) == 3
+    assert 'y' in record and 'w' not in record
+    assert record.get('w', 5) == 5 and record.get('z', 5) is None
+    with pytest.raises(KeyError):
+        record['w']
+    with pytest.raises(TypeError):
+        record['x'] = 2
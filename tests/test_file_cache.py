@@ -0,0 +1,73 @@
+"""
+Тесты кэша файлов GitHub (TTL, отдача последней версии при ошибке)
+"""
+import os
+import sys
+from collections import OrderedDict
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server  # noqa: E402
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Подмена fetch_file: ответы по очереди из results, вызовы - в calls"""
+    state = {'now': 1000.0, 'results': [], 'calls': []}
+
+    def fake_fetch(filename, max_age=0, current=None):
+        state['calls'].append(filename)
+        return state['results'].pop(0)
+
+    monkeypatch.setattr(api_server, 'fetch_file', fake_fetch)
+    monkeypatch.setattr(api_server.time, 'monotonic', lambda: state['now'])
+    monkeypatch.setattr(api_server, 'file_cache', OrderedDict())
+    monkeypatch.setattr(api_server, 'missing_files', OrderedDict())
+    monkeypatch.setattr(api_server, 'CACHE_RETRY_INTERVAL', 5.0)
+    monkeypatch.setitem(api_server.file_cache_stats, 'bytes', 0)
+    return state
+
+
+def ok(data, version='v1'):
+    return {'status': 'ok', 'data': data, 'version': version, 'size': 10}
+
+
+def error():
+    return {'status': 'error', 'data': None, 'error': 'timeout'}
+
+
+def test_fresh_entry_served_from_memory(upstream):
+    upstream['results'] = [ok({'a': 1})]
+    first = api_server.get_cached_file_entry('region_77.json')
+    assert api_server.get_cached_file_entry('region_77.json') is first
+    assert len(upstream['calls']) == 1
+
+
+def test_upstream_error_serves_stale_and_backs_off(upstream):
+    ttl = api_server.get_file_ttl('region_77.json')
+    upstream['results'] = [ok({'a': 1}), error()]
+    entry = api_server.get_cached_file_entry('region_77.json')
+
+    upstream['now'] += ttl + 1
+    assert api_server.get_cached_file_entry('region_77.json') is entry
+    assert len(upstream['calls']) == 2
+
+    # В паузе после ошибки GitHub не спрашиваем
+    for _ in range(10):
+        upstream['now'] += 0.4
+        assert api_server.get_cached_file_entry('region_77.json') is entry
+    assert len(upstream['calls']) == 2
+
+    upstream['now'] += 2
+    upstream['results'] = [ok({'a': 2}, 'v2')]
+    assert api_server.get_cached_file_entry('region_77.json')['data'] == {'a': 2}
+    assert len(upstream['calls']) == 3
+
+
+def test_missing_file_is_negatively_cached(upstream):
+    upstream['results'] = [{'status': 'missing', 'data': None, 'http_status': 404}]
+    assert api_server.get_cached_file_entry('history_99.json') is None
+    assert api_server.get_cached_file_entry('history_99.json') is None
+    assert len(upstream['calls']) == 1
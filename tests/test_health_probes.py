@@ -0,0 +1,104 @@
+"""
+Тесты фоновых проверок доступности: эндпоинты не ждут сеть, LDAP не задерживает GitHub
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeSession:
+    """Сессия, которая отвечает только после release"""
+
+    def __init__(self, status_code=200, blocked=False):
+        self.status_code = status_code
+        self.released = threading.Event()
+        if not blocked:
+            self.released.set()
+        self.calls = []
+
+    def request(self, method, url, timeout=None):
+        self.calls.append((method, url))
+        self.released.wait(5)
+        return FakeResponse(self.status_code)
+
+
+@pytest.fixture
+def prober(monkeypatch):
+    """Потоки проверок не запускаются сами: задачи собираются в словарь"""
+    tasks = {}
+    monkeypatch.setattr(api_server, 'health_prober_started', False)
+    monkeypatch.setattr(api_server, 'health_probes', {
+        'ldap': {'status': 'unknown'},
+        'github': {'status': 'unknown'}
+    })
+    monkeypatch.setattr(api_server, 'run_periodically',
+                        lambda name, interval, fn: tasks.setdefault(name, fn))
+    monkeypatch.setattr(api_server, 'LDAP_SERVER_URL', 'https://ldap.example/api/ldap/auth')
+    return tasks
+
+
+def test_first_call_does_not_wait(prober):
+    started = time.monotonic()
+    result = api_server.get_probe_result('github')
+    assert time.monotonic() - started < 0.1
+    assert result == {'status': 'unknown', 'age_seconds': None}
+    assert sorted(prober) == ['health-prober-github', 'health-prober-ldap']
+
+
+def test_probes_start_once(prober):
+    api_server.get_probe_result('ldap')
+    prober.clear()
+    api_server.get_probe_result('github')
+    assert prober == {}
+
+
+def test_ldap_not_configured(prober, monkeypatch):
+    monkeypatch.setattr(api_server, 'LDAP_SERVER_URL', None)
+    assert api_server.get_probe_result('ldap')['status'] == 'not_configured'
+    assert sorted(prober) == ['health-prober-github']
+
+
+def test_slow_ldap_does_not_delay_github(prober, monkeypatch):
+    ldap = FakeSession(blocked=True)
+    github = FakeSession(status_code=503)
+    monkeypatch.setattr(api_server, 'ldap_session', ldap)
+    monkeypatch.setattr(api_server, 'upstream_session', github)
+    api_server.get_probe_result('github')
+
+    threads = {name: threading.Thread(target=fn) for name, fn in prober.items()}
+    for thread in threads.values():
+        thread.start()
+    try:
+        threads['health-prober-github'].join(2)
+        github_result = api_server.get_probe_result('github')
+        assert github_result['status'] == 'unavailable'
+        assert github_result['status_code'] == 503
+        assert github_result['age_seconds'] is not None
+        assert api_server.get_probe_result('ldap')['status'] == 'unknown'
+    finally:
+        ldap.released.set()
+        for thread in threads.values():
+            thread.join(2)
+
+    assert api_server.get_probe_result('ldap')['status'] == 'available'
+    assert ldap.calls == [('GET', 'https://ldap.example/health')]
+
+
+def test_health_endpoint_serves_cached_result(prober):
+    client = api_server.app.test_client()
+    started = time.monotonic()
+    body = client.get('/api/health').get_json()
+    assert time.monotonic() - started < api_server.HEALTH_PROBE_TIMEOUT
+    assert body['upstream']['github']['status'] == 'unknown'
@@ -0,0 +1,152 @@
+"""
+Тесты постраничной выдачи истории (limit / cursor)
+"""
+import base64
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server  # noqa: E402
+
+START = datetime(2024, 1, 1, 0, 0, 0)
+
+
+def make_history(count, start=0):
+    """Записи id start..start+count-1 через 5 минут; каждая седьмая - с тем же
+    временем, что предыдущая. Время зависит только от id (одинаково в версиях)"""
+    return [
+        {'id': i, 'full_timestamp': (START + timedelta(minutes=5 * (i - i // 7))).isoformat(),
+         'stats': {'total_bs': i}}
+        for i in range(start, start + count)
+    ]
+
+
+def walk(index, limit, cutoff=None):
+    """Все страницы через курсор (курсор проходит через encode/decode)"""
+    pages = []
+    cursor = None
+    while True:
+        page, next_cursor, total = api_server.paginate_history(index, cutoff, limit, cursor)
+        pages.append(page)
+        if next_cursor is None:
+            return pages, total
+        assert len(page) == limit
+        cursor = api_server.decode_cursor(api_server.encode_cursor(next_cursor))
+
+
+def ids(pages):
+    return [item['id'] for page in pages for item in page]
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 7, 50, 1000])
+@pytest.mark.parametrize('order', ['ascending', 'descending'])
+def test_walk_returns_every_entry_once(limit, order):
+    history = make_history(50)
+    if order == 'descending':
+        history.reverse()
+    history.insert(10, {'id': 'bad-1', 'full_timestamp': 'не время'})
+    history.append({'id': 'bad-2', 'full_timestamp': None})
+    index = api_server.build_history_index(history)
+
+    pages, total = walk(index, limit)
+    assert total == len(history)
+    # Порядок как в исходном списке, записи без времени - в конце
+    expected = [item['id'] for item in history if not str(item['id']).startswith('bad')]
+    assert ids(pages) == expected + ['bad-1', 'bad-2']
+
+
+def test_walk_with_cutoff():
+    history = make_history(40)
+    index = api_server.build_history_index(history)
+    cutoff = api_server.parse_history_time(history[29]['full_timestamp'])
+
+    pages, total = walk(index, 4, cutoff)
+    expected = [item['id'] for item in history
+                if api_server.parse_history_time(item['full_timestamp']) > cutoff]
+    assert ids(pages) == expected
+    assert total == len(expected)
+
+
+@pytest.mark.parametrize('order', ['ascending', 'descending'])
+def test_cursor_survives_history_version_change(order):
+    """Новые записи добавились, старые ушли - продолжение без повторов и пропусков"""
+    old = make_history(30)
+    new = make_history(30, start=10)
+    if order == 'descending':
+        old.reverse()
+        new.reverse()
+
+    first, cursor, _ = api_server.paginate_history(api_server.build_history_index(old), None, 12)
+    cursor = api_server.decode_cursor(api_server.encode_cursor(cursor))
+    rest, next_cursor, _ = api_server.paginate_history(api_server.build_history_index(new), None, 1000, cursor)
+    assert next_cursor is None
+
+    seen = [item['id'] for item in first]
+    resumed = [item['id'] for item in rest]
+    assert not set(seen) & set(resumed)
+    if order == 'ascending':
+        # Все, что новее последней выданной записи, включая добавленные
+        assert resumed == list(range(seen[-1] + 1, 40))
+    else:
+        # От новых к старым: продолжаем с записи старше последней выданной
+        assert resumed == [i for i in range(39, 9, -1) if i < seen[-1]]
+
+
+def encode_raw(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+BAD_CURSORS = [
+    'не-base64!',
+    encode_raw([1, 2]),
+    encode_raw({'x': 1}),
+    encode_raw({'t': 'abc', 'n': 1}),
+    encode_raw({'t': 1.5}),
+    encode_raw({'t': 1.5, 'n': -1}),
+    encode_raw({'t': 1.5, 'n': 'x'}),
+    encode_raw({'t': True, 'n': 0}),
+    encode_raw({'u': -3}),
+    encode_raw({'u': 1.5}),
+]
+
+
+@pytest.mark.parametrize('cursor', BAD_CURSORS)
+def test_decode_cursor_rejects_tampered(cursor):
+    with pytest.raises(ValueError):
+        api_server.decode_cursor(cursor)
+
+
+@pytest.fixture
+def history_file(monkeypatch):
+    """history_77.json в кэше файлов без обращения к GitHub"""
+    entry = {'data': {'region_code': '77', 'history': make_history(25)}, 'version': 'v1'}
+    monkeypatch.setattr(api_server, 'get_cached_file_entry',
+                        lambda filename, **kwargs: entry if filename == 'history_77.json' else None)
+    monkeypatch.setitem(api_server.RATE_LIMIT_RULES, 'history', (1e9, 1e9))
+    return entry
+
+
+@pytest.mark.parametrize('cursor', BAD_CURSORS)
+def test_endpoint_rejects_tampered_cursor(history_file, cursor):
+    response = api_server.app.test_client().get(f'/api/region/77/history?limit=5&cursor={cursor}')
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_endpoint_walk(history_file):
+    client = api_server.app.test_client()
+    url = '/api/region/77/history?limit=4&fields=id,full_timestamp'
+    collected = []
+    while url:
+        body = client.get(url).get_json()
+        assert body['total'] == 25
+        collected.extend(body['history'])
+        url = (f"/api/region/77/history?limit=4&fields=id,full_timestamp&cursor={body['next_cursor']}"
+               if body['has_more'] else None)
+    assert [item['id'] for item in collected] == list(range(25))
+    assert set(collected[0]) == {'id', 'full_timestamp'}
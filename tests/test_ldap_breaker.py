@@ -0,0 +1,121 @@
+"""
+Тесты circuit breaker LDAP шлюза (переходы состояний по времени)
+"""
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server  # noqa: E402
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Свежий breaker (порог 3, пауза 30с) и управляемое время"""
+    state = {'now': 1000.0}
+    monkeypatch.setattr(api_server.time, 'monotonic', lambda: state['now'])
+    monkeypatch.setattr(api_server, 'LDAP_BREAKER_THRESHOLD', 3)
+    monkeypatch.setattr(api_server, 'LDAP_BREAKER_RESET_TIMEOUT', 30.0)
+    monkeypatch.setattr(api_server, 'ldap_breaker', {
+        'state': 'closed',
+        'failures': 0,
+        'opened_at': None,
+        'last_error': None,
+        'probe_in_flight': False,
+        'trips': 0
+    })
+    return state
+
+
+def fail(times=1):
+    for _ in range(times):
+        assert api_server.ldap_breaker_allow()
+        api_server.ldap_breaker_record(False, 'timeout')
+
+
+def state():
+    return api_server.ldap_breaker['state']
+
+
+def test_opens_after_threshold_failures(clock):
+    fail(2)
+    assert state() == 'closed'
+    fail()
+    assert state() == 'open'
+    assert api_server.ldap_breaker['trips'] == 1
+    assert not api_server.ldap_breaker_allow()
+
+
+def test_success_resets_failure_count(clock):
+    fail(2)
+    api_server.ldap_breaker_record(True)
+    fail(2)
+    assert state() == 'closed'
+
+
+def test_client_errors_count_as_success(clock):
+    """4xx (неверный пароль) - шлюз жив, сбоем не считается"""
+    fail(2)
+    api_server.ldap_breaker_record(True, 'HTTP 401')
+    fail(2)
+    assert state() == 'closed'
+
+
+def test_stays_open_until_reset_timeout(clock):
+    fail(3)
+    clock['now'] += 29.9
+    assert not api_server.ldap_breaker_allow()
+    assert api_server.get_ldap_breaker_status()['retry_in'] == pytest.approx(0.1)
+
+
+def test_half_open_allows_single_probe(clock):
+    fail(3)
+    clock['now'] += 30
+    assert api_server.ldap_breaker_allow()
+    assert state() == 'half_open'
+    # Пока пробный запрос не завершился, остальные не проходят
+    assert not api_server.ldap_breaker_allow()
+    assert not api_server.ldap_breaker_allow()
+
+
+def test_successful_probe_closes(clock):
+    fail(3)
+    clock['now'] += 30
+    assert api_server.ldap_breaker_allow()
+    api_server.ldap_breaker_record(True)
+    assert state() == 'closed'
+    assert api_server.ldap_breaker['failures'] == 0
+    assert api_server.ldap_breaker_allow()
+    assert api_server.ldap_breaker_allow()
+
+
+def test_failed_probe_reopens_for_full_timeout(clock):
+    fail(3)
+    clock['now'] += 30
+    assert api_server.ldap_breaker_allow()
+    api_server.ldap_breaker_record(False, 'connection_error')
+    assert state() == 'open'
+    assert api_server.ldap_breaker['trips'] == 2
+    assert api_server.ldap_breaker['last_error'] == 'connection_error'
+    clock['now'] += 29
+    assert not api_server.ldap_breaker_allow()
+    clock['now'] += 1
+    assert api_server.ldap_breaker_allow()
+
+
+def test_open_breaker_skips_gateway_call(clock, monkeypatch):
+    calls = []
+
+    def post(*args, **kwargs):
+        calls.append(1)
+        raise requests.exceptions.ConnectionError('down')
+
+    monkeypatch.setattr(api_server, 'LDAP_SERVER_URL', 'http://ldap.invalid/api/ldap/auth')
+    monkeypatch.setattr(api_server.ldap_session, 'post', post)
+    with api_server.app.test_request_context():
+        codes = [api_server.make_ldap_request('user', 'secret')['error_code'] for _ in range(5)]
+    assert codes == ['LDAP_CONNECTION_ERROR'] * 3 + ['LDAP_CIRCUIT_OPEN'] * 2
+    assert len(calls) == 3
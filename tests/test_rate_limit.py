@@ -0,0 +1,103 @@
+"""
+Тесты ограничения частоты запросов (token bucket, ключ клиента)
+"""
+import os
+import sys
+from collections import OrderedDict
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(api_server.time, 'monotonic', fake)
+    monkeypatch.setattr(api_server, 'rate_buckets', OrderedDict())
+    monkeypatch.setitem(api_server.RATE_LIMIT_RULES, 'test', (3.0, 0.5))
+    return fake
+
+
+def test_bucket_allows_burst_then_limits(clock):
+    assert [api_server.take_rate_token('test', 'ip:1') for _ in range(3)] == [0, 0, 0]
+    # Пусто: токен появится через 1 / 0.5 = 2 секунды
+    assert api_server.take_rate_token('test', 'ip:1') == pytest.approx(2.0)
+
+
+def test_bucket_refills_over_time(clock):
+    for _ in range(3):
+        api_server.take_rate_token('test', 'ip:1')
+    clock.now += 1.0
+    assert api_server.take_rate_token('test', 'ip:1') == pytest.approx(1.0)
+    clock.now += 1.0
+    assert api_server.take_rate_token('test', 'ip:1') == 0
+
+
+def test_bucket_refill_capped_by_capacity(clock):
+    api_server.take_rate_token('test', 'ip:1')
+    clock.now += 3600
+    assert [api_server.take_rate_token('test', 'ip:1') for _ in range(4)][-1] > 0
+
+
+def test_buckets_are_per_client_and_route(clock, monkeypatch):
+    monkeypatch.setitem(api_server.RATE_LIMIT_RULES, 'other', (1.0, 0.5))
+    for _ in range(3):
+        api_server.take_rate_token('test', 'ip:1')
+    assert api_server.take_rate_token('test', 'ip:1') > 0
+    assert api_server.take_rate_token('test', 'ip:2') == 0
+    assert api_server.take_rate_token('other', 'ip:1') == 0
+
+
+def test_bucket_table_is_bounded(clock, monkeypatch):
+    monkeypatch.setattr(api_server, 'RATE_LIMIT_MAX_KEYS', 5)
+    for i in range(20):
+        api_server.take_rate_token('test', f'ip:{i}')
+    assert list(api_server.rate_buckets) == [('test', f'ip:{i}') for i in range(15, 20)]
+
+
+def test_parse_rate_limits():
+    assert api_server.parse_rate_limits('login=10/60, refresh = 6/30,bad=x,,empty') == {
+        'login': (10.0, 10.0 / 60),
+        'refresh': (6.0, 0.2)
+    }
+
+
+def test_client_key_prefers_token_user():
+    with api_server.app.test_request_context(environ_base={'REMOTE_ADDR': '10.1.1.1'}):
+        api_server.g.auth_user = {'sub': 'operator'}
+        assert api_server.get_client_key() == 'user:operator'
+
+
+def test_client_key_ignores_forwarded_header_without_proxy_fix():
+    # Без ProxyFix (прямой WSGI вызов) X-Forwarded-For не влияет на ключ
+    with api_server.app.test_request_context(
+        environ_base={'REMOTE_ADDR': '10.1.1.1'},
+        headers={'X-Forwarded-For': '6.6.6.6'}
+    ):
+        assert api_server.get_client_key() == 'ip:10.1.1.1'
+
+
+@pytest.mark.skipif(api_server.TRUSTED_PROXY_COUNT != 1, reason='проверка для одного доверенного прокси')
+def test_spoofed_forwarded_for_does_not_bypass_limit(clock, monkeypatch):
+    """Клиент дописывает левые адреса в X-Forwarded-For - прокси добавляет настоящий справа"""
+    monkeypatch.setitem(api_server.RATE_LIMIT_RULES, 'bs', (2.0, 0.001))
+    client = api_server.app.test_client()
+    statuses = [
+        client.get('/api/bs/search', headers={'X-Forwarded-For': f'1.2.3.{i}, 10.0.0.7'}).status_code
+        for i in range(4)
+    ]
+    assert statuses == [400, 400, 429, 429]
+    # Другой настоящий адрес - своя корзина
+    assert client.get('/api/bs/search', headers={'X-Forwarded-For': '10.0.0.8'}).status_code == 400
+    assert ('bs', 'ip:10.0.0.7') in api_server.rate_buckets
@@ -0,0 +1,79 @@
+"""
+Тесты пакетного запроса регионов: из GitHub грузятся только известные коды и не больше лимита
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server  # noqa: E402
+
+
+def region(code):
+    return {'current': {'region_name': f'Регион {code}', 'source': 'aggregate'}}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Файлы регионов: cached - уже в памяти, остальные загружаются с записью в fetched"""
+    state = {'cached': {}, 'fetched': [], 'aggregate': {}}
+
+    def fake_entry(filename, **kwargs):
+        if filename in state['cached']:
+            return state['cached'][filename]
+        state['fetched'].append(filename)
+        return {'data': {'source': 'file', 'file': filename}, 'version': 'v1'}
+
+    monkeypatch.setattr(api_server, 'get_cached_file_entry', fake_entry)
+    monkeypatch.setattr(api_server, 'is_file_cached', lambda filename: filename in state['cached'])
+    monkeypatch.setattr(api_server, 'get_cached_data', lambda: state['aggregate'])
+    monkeypatch.setattr(api_server, 'BATCH_MAX_UPSTREAM_FETCHES', 2)
+    monkeypatch.setitem(api_server.RATE_LIMIT_RULES, 'batch', (1e9, 1e9))
+    return state
+
+
+def get_batch(codes):
+    response = api_server.app.test_client().get(f'/api/regions/batch?codes={codes}')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_unknown_codes_are_not_fetched(upstream):
+    upstream['aggregate'] = {'_meta': {}, '77': region('77')}
+    body = get_batch('77,_meta,99999,../etc')
+
+    assert upstream['fetched'] == ['region_77.json']
+    assert body['regions'] == {'77': {'source': 'file', 'file': 'region_77.json'}}
+    assert body['missing'] == ['_meta', '99999', '../etc']
+
+
+def test_fetches_are_bounded(upstream):
+    upstream['aggregate'] = {code: region(code) for code in ('10', '20', '30', '40')}
+    upstream['cached'] = {'region_40.json': {'data': {'source': 'memory'}, 'version': 'm1'}}
+    body = get_batch('10,20,30,40')
+
+    assert upstream['fetched'] == ['region_10.json', 'region_20.json']
+    assert body['regions']['10']['source'] == 'file'
+    assert body['regions']['20']['source'] == 'file'
+    assert body['regions']['30'] == {'region_name': 'Регион 30', 'source': 'aggregate'}
+    assert body['regions']['40'] == {'source': 'memory'}
+    assert body['missing'] == []
+
+
+def test_cached_missing_file_falls_back_to_aggregate(upstream):
+    upstream['aggregate'] = {'77': region('77')}
+    upstream['cached'] = {'region_77.json': None}
+    body = get_batch('77')
+
+    assert upstream['fetched'] == []
+    assert body['regions']['77']['source'] == 'aggregate'
+
+
+def test_without_aggregate_only_the_limit_applies(upstream):
+    body = get_batch('1,2,3')
+
+    assert upstream['fetched'] == ['region_1.json', 'region_2.json']
+    assert sorted(body['regions']) == ['1', '2']
+    assert body['missing'] == ['3']
@@ -0,0 +1,175 @@
+"""
+Тесты потокового разбора cached_data.json (iter_json_members / scan_json_value)
+"""
+import hashlib
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server  # noqa: E402
+
+SAMPLE = {
+    '_meta': {'updated': '2024-01-01T10:00:00', 'regions': 2},
+    '77': {
+        'current': {
+            'region_code': '77',
+            'base_layer': 'Недоступно LTE1800:\n1) BS1001',
+            'tricky': 'кавычка " слеш \\ скобки }{][ и "ключ": 1',
+            'stats': {'total_bs': 100, 'power_problems': 2}
+        },
+        'history': [
+            {'full_timestamp': '2024-01-01T09:00:00', 'stats': {'total_bs': 99}, 'text': '}]\\"'},
+            {'full_timestamp': '2024-01-01T10:00:00', 'stats': {'total_bs': 100}, 'text': ''}
+        ]
+    },
+    '50': {'current': {'region_code': '50', 'stats': {}}, 'history': []},
+    '_number': 12.5e3,
+    '_string': 'строка с } и ]',
+    '_list': [1, {'a': ']'}, [[], {}]],
+    '_flags': [True, False, None],
+    '_null': None
+}
+
+
+def split(raw, size):
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+
+def materialize(data):
+    """Данные с декодированной историей (для сравнения с json.loads)"""
+    result = {}
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(value.get('history'), bytes):
+            value = dict(value, history=json.loads(value['history']))
+        result[key] = value
+    return result
+
+
+def materialize_views(data):
+    """То же для данных из снимка, где история - memoryview"""
+    return materialize({
+        key: dict(value, history=bytes(value['history']))
+        if isinstance(value, dict) and isinstance(value.get('history'), memoryview) else value
+        for key, value in data.items()
+    })
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 1 << 20])
+def test_streamed_load_matches_json_loads(indent, chunk_size):
+    raw = json.dumps(SAMPLE, ensure_ascii=False, indent=indent).encode('utf-8')
+    data, size, digest = api_server.load_streamed_json(split(raw, chunk_size))
+
+    assert materialize(data) == SAMPLE
+    assert size == len(raw)
+    assert digest == hashlib.sha1(raw).hexdigest()
+
+
+def test_history_stays_encoded():
+    raw = json.dumps(SAMPLE, ensure_ascii=False).encode('utf-8')
+    data, _, _ = api_server.load_streamed_json(split(raw, 5))
+
+    assert isinstance(data['77']['history'], bytes)
+    assert isinstance(data['77']['current'], dict)
+    assert api_server.region_has_history(data['77'])
+    assert not api_server.region_has_history(data['50'])
+
+
+def test_dump_lazy_json_round_trip():
+    raw = json.dumps(SAMPLE, ensure_ascii=False).encode('utf-8')
+    data, _, _ = api_server.load_streamed_json([raw])
+    assert json.loads(api_server.dump_lazy_json(data)) == SAMPLE
+
+
+def test_trailing_whitespace_counted():
+    raw = b'  {"a": {"history": [1]}}  \n'
+    data, size, _ = api_server.load_streamed_json(split(raw, 4))
+    assert data == {'a': {'history': b'[1]'}}
+    assert size == len(raw)
+
+
+def test_empty_object():
+    assert list(api_server.iter_json_members([b' { } '])) == []
+
+
+@pytest.mark.parametrize('raw', [
+    b'{"a": [1, 2',
+    b'{"a": "unterminated',
+    b'{"a": 1',
+    b'{"a"',
+    b'',
+])
+def test_truncated_input_raises(raw):
+    with pytest.raises(ValueError):
+        list(api_server.iter_json_members(split(raw, 3) or [b'']))
+
+
+@pytest.mark.parametrize('raw', [b'[1, 2]', b'{"a" 1}', b'{"a": 1 "b": 2}', b'{1: 2}'])
+def test_malformed_input_raises(raw):
+    with pytest.raises(ValueError):
+        list(api_server.iter_json_members([raw]))
+
+
+def test_scan_json_value_resumes_across_chunks():
+    value = b'{"k": "a\\"}", "n": [1, {"x": "]"}]}'
+    buffer = bytearray()
+    state = None
+    end = None
+    for chunk in split(value + b', "next": 1', 3):
+        buffer.extend(chunk)
+        end, state = api_server.scan_json_value(buffer, 0, state)
+        if end is not None:
+            break
+    assert bytes(buffer[:end]) == value
+
+
+def test_scan_json_value_scalars():
+    assert api_server.scan_json_value(b'"a\\"b", 1', 0) == (6, None)
+    assert api_server.scan_json_value(b'123}', 0) == (3, None)
+    assert api_server.scan_json_value(b'true', 0) == (None, None)
+    assert api_server.scan_json_value(b'"abc', 0) == (None, None)
+
+
+def test_aggregate_index_built_once_per_version(monkeypatch):
+    """Индекс истории общего кэша не перестраивается, пока те же байты истории"""
+    raw = json.dumps({
+        f'{code:02d}': {
+            'current': {},
+            'history': [{'full_timestamp': '2024-01-01T10:00:00', 'stats': {'total_bs': code}}]
+        } for code in range(1, 41)
+    }).encode('utf-8')
+    data, _, _ = api_server.load_streamed_json([raw])
+
+    calls = []
+    original = api_server.decode_history_json
+    monkeypatch.setattr(api_server, 'decode_history_json', lambda value: calls.append(1) or original(value))
+
+    for _ in range(3):
+        for code, region in data.items():
+            index = api_server.get_aggregate_history_index(code, region)
+            assert index['history'][0]['stats']['total_bs'] == int(code)
+    assert len(calls) == 40
+
+
+def test_mapped_load_keeps_history_as_views(tmp_path):
+    """Снимок общего кэша: история - memoryview на файл, без копии"""
+    raw = json.dumps(SAMPLE, ensure_ascii=False, indent=1).encode('utf-8')
+    path = tmp_path / 'snapshot'
+    path.write_bytes(b'{"version": "v1"}\n' + raw)
+
+    with open(path, 'rb') as handle:
+        handle.readline()
+        data, size = api_server.load_mapped_json(handle)
+
+    assert size == len(raw)
+    assert isinstance(data['77']['history'], memoryview)
+    assert materialize_views(data) == SAMPLE
+    assert api_server.region_has_history(data['77'])
+    assert not api_server.region_has_history(data['50'])
+    assert json.loads(api_server.dump_lazy_json(data)) == SAMPLE
+    index = api_server.get_aggregate_history_index('77', data['77'])
+    assert index['history'][1]['stats']['total_bs'] == 100
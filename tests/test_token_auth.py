@@ -0,0 +1,89 @@
+"""
+Тесты проверки токена: ?access_token= только там, где разрешен, и не в журналах доступа
+"""
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api_server, 'AUTH_TOKEN_REQUIRED', True)
+    monkeypatch.setattr(api_server, 'SSE_MAX_SUBSCRIBERS', 0)
+    monkeypatch.setitem(api_server.RATE_LIMIT_RULES, 'stream', (1e9, 1e9))
+    monkeypatch.setitem(api_server.RATE_LIMIT_RULES, 'bs', (1e9, 1e9))
+    return api_server.app.test_client()
+
+
+@pytest.fixture
+def token():
+    return api_server.issue_session_token('tester', 'fallback')['token']
+
+
+def test_stream_accepts_query_token(client, token):
+    # Токен принят - дальше поток отвечает, что он выключен
+    assert client.get(f'/api/stream?access_token={token}').status_code == 503
+    assert client.get('/api/stream?access_token=bad.token').status_code == 401
+    assert client.get('/api/stream').status_code == 401
+
+
+def test_header_token_wins_over_query(client, token):
+    response = client.get('/api/stream?access_token=bad.token',
+                          headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 503
+
+
+def test_query_token_ignored_without_flag(client, token):
+    response = client.get(f'/api/bs/search?access_token={token}')
+    assert response.status_code == 401
+    assert response.get_json()['error_code'] == 'TOKEN_REQUIRED'
+
+
+def test_query_token_removed_from_environ(client, token, monkeypatch):
+    """gunicorn пишет журнал доступа из того же environ после ответа"""
+    seen = []
+    wsgi_app = api_server.app.wsgi_app
+
+    def recording_app(environ, start_response):
+        seen.append(environ)
+        return wsgi_app(environ, start_response)
+
+    monkeypatch.setattr(api_server.app, 'wsgi_app', recording_app)
+    client.get(f'/api/stream?regions=77&access_token={token}',
+               environ_overrides={'RAW_URI': f'/api/stream?regions=77&access_token={token}'})
+    client.get(f'/api/bs/search?access_token={token}')
+    assert seen[0]['QUERY_STRING'] == 'regions=77&access_token=***'
+    assert seen[0]['RAW_URI'] == '/api/stream?regions=77&access_token=***'
+    assert seen[1]['QUERY_STRING'] == 'access_token=***'
+
+
+def test_decorator_forms():
+    def view():
+        return 'ok'
+
+    assert api_server.token_auth(view).__name__ == 'view'
+    assert api_server.token_auth(allow_query_token=True)(view).__name__ == 'view'
+
+
+def test_werkzeug_log_is_redacted(caplog):
+    logger = logging.getLogger('werkzeug')
+    with caplog.at_level(logging.INFO, logger='werkzeug'):
+        logger.info('"%s" %s %s', 'GET /api/stream?access_token=abc.def&regions=77 HTTP/1.1', 200, '-')
+    assert caplog.messages == ['"GET /api/stream?access_token=***&regions=77 HTTP/1.1" 200 -']
+
+
+def test_gevent_log_is_redacted():
+    written = []
+
+    class Stream:
+        def write(self, data):
+            written.append(data)
+
+    api_server.AccessTokenLog(Stream()).write('GET /api/stream?access_token=abc HTTP/1.1" 200\n')
+    assert written == ['GET /api/stream?access_token=*** HTTP/1.1" 200\n']